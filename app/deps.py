@@ -1,12 +1,15 @@
-from sqlalchemy.orm import Session
 from fastapi import Depends, HTTPException, status, Request
-from passlib.context import CryptContext
 from app.enums.user_type import UserType
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
-from app.database import SessionLocal
+from app.database import SessionLocal, AsyncSessionLocal
 from app.models import User
-import bcrypt
+from app.helper.cache_helper import TTLCache
+from app.helper.password_helper import password_hasher
+from app.helper.timing_helper import span
+from dataclasses import dataclass
+from sqlalchemy import event
+import os
 
 
 SECRET_KEY = "abcd"
@@ -15,7 +18,8 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
 
 # ---------- Database Dependency ----------
 def get_db():
@@ -25,6 +29,10 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def safe_password_truncate(password: str) -> str:
     """
     Safely truncate password to 72 bytes for bcrypt compatibility.
@@ -58,24 +66,20 @@ def validate_password(password: str) -> tuple[bool, str]:
         return False, "Password must be at least 6 characters long"
     return True, ""
 
-def get_password_hash(password: str) -> str:
-    """Hash a password using bcrypt directly"""
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password on the bounded bcrypt pool"""
     is_valid, error_message = validate_password(password)
     if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=error_message
         )
-    
-    password_to_hash = safe_password_truncate(password).encode('utf-8')
-    hashed = bcrypt.hashpw(password_to_hash, bcrypt.gensalt())
-    return hashed.decode('utf-8')
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its bcrypt hash"""
-    password_bytes = safe_password_truncate(plain_password).encode('utf-8')
-    hashed_bytes = hashed_password.encode('utf-8')
-    return bcrypt.checkpw(password_bytes, hashed_bytes)
+    return await password_hasher.hash(safe_password_truncate(password).encode('utf-8'))
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the bounded bcrypt pool"""
+    return await password_hasher.verify(safe_password_truncate(plain_password).encode('utf-8'), hashed_password)
 
 # ---------- JWT ----------
 def create_access_token(user_id: int) -> str:
@@ -90,23 +94,67 @@ def create_refresh_token(user_id: int) -> str:
     payload = {"sub": str(user_id), "type": "refresh", "exp": expire}
     return jwt.encode(payload, REFRESH_SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
+# ---------- Principal cache ----------
+@dataclass(frozen=True)
+class Principal:
+    """
+    Read-only snapshot of the authenticated user, safe to share across requests
+    """
+    user_id: int
+    firstname: str
+    lastname: str
+    email: str
+    user_type: int
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            user_id=user.user_id,
+            firstname=user.firstname,
+            lastname=user.lastname,
+            email=user.email,
+            user_type=user.user_type
+        )
+
+principal_cache = TTLCache(max_size=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_principal(mapper, connection, target):
+    principal_cache.invalidate(target.user_id)
+
+def get_current_user(request: Request) -> Principal:
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
     
     token = auth_header.split(" ")[1]
+    with span("auth"):
+        return authenticate_token(token)
+
+def authenticate_token(token: str) -> Principal:
+    """Resolve an access token to its principal, raising 401 if it is invalid"""
     payload = verify_token(token, SECRET_KEY)
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id = int(payload.get("sub"))
-    except JWTError:
+    except (AttributeError, TypeError, ValueError):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     
-    user = db.query(User).filter(User.user_id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.user_id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        principal = Principal.from_user(user)
+    finally:
+        db.close()
+
+    principal_cache.set(user_id, principal)
+    return principal
 
 def verify_token(token: str, secret_key: str):
     try:
@@ -116,7 +164,7 @@ def verify_token(token: str, secret_key: str):
         return None
     
 def require_role(*allowed_roles: UserType):
-    def role_checker(current_user: User = Depends(get_current_user)):
+    def role_checker(current_user: Principal = Depends(get_current_user)):
         if current_user.user_type not in [role.value for role in allowed_roles]:
             raise HTTPException(
                 status_code=403,
@@ -0,0 +1,7 @@
+from enum import Enum
+
+class GenerationStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
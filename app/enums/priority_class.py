@@ -0,0 +1,8 @@
+from enum import IntEnum
+
+class PriorityClass(IntEnum):
+    # Lower value is scheduled first
+    ADMIN_INTERACTIVE = 0
+    USER_INTERACTIVE = 1
+    ADMIN_BATCH = 2
+    USER_BATCH = 3
@@ -0,0 +1,194 @@
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List
+from dotenv import load_dotenv
+
+from app.helper.cache_helper import TTLCache
+from app.helper.poller_helper import runpod_poller
+
+load_dotenv()
+
+# RunPod jobs submitted and not yet finished, overall and per user
+RUNPOD_MAX_CONCURRENT = int(os.getenv("RUNPOD_MAX_CONCURRENT", "20"))
+RUNPOD_MAX_CONCURRENT_PER_USER = int(os.getenv("RUNPOD_MAX_CONCURRENT_PER_USER", "5"))
+# Admitted jobs waiting for a RunPod slot, overall and per user
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "200"))
+ADMISSION_MAX_WAITING_PER_USER = int(os.getenv("ADMISSION_MAX_WAITING_PER_USER", "100"))
+# Per-user token bucket on generation requests that reach RunPod
+GENERATION_RATE = float(os.getenv("GENERATION_RATE", "1"))
+GENERATION_BURST = int(os.getenv("GENERATION_BURST", "10"))
+ADMISSION_MIN_RETRY_AFTER = int(os.getenv("ADMISSION_MIN_RETRY_AFTER", "1"))
+
+
+class AdmissionRejectedError(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Classic token bucket: rate tokens per second up to capacity.
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        Take tokens if available and return 0, otherwise return the seconds
+        until enough tokens will have accumulated.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+
+@dataclass
+class AdmissionTicket:
+    user_id: int
+    # waiting -> running -> done
+    state: str = "waiting"
+
+
+class AdmissionController:
+    """
+    Decides whether generation work may enter the pipeline and how much of
+    it may be at RunPod at once.
+    admit() runs in the request and fails fast with a retry hint; the
+    worker pool only dispatches a job once has_slot() allows it, so a job
+    never occupies a worker while waiting for RunPod capacity.
+    """
+    def __init__(
+        self,
+        max_running: int = RUNPOD_MAX_CONCURRENT,
+        max_running_per_user: int = RUNPOD_MAX_CONCURRENT_PER_USER,
+        max_waiting: int = ADMISSION_MAX_WAITING,
+        max_waiting_per_user: int = ADMISSION_MAX_WAITING_PER_USER,
+        rate: float = GENERATION_RATE,
+        burst: int = GENERATION_BURST
+    ):
+        self.max_running = max_running
+        self.max_running_per_user = max_running_per_user
+        self.max_waiting = max_waiting
+        self.max_waiting_per_user = max_waiting_per_user
+        self.rate = rate
+        self.burst = burst
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+        self._user_waiting: Dict[int, int] = defaultdict(int)
+        self._user_running: Dict[int, int] = defaultdict(int)
+        # A bucket idle for the time it takes to refill is full, so evicting it loses nothing
+        self._buckets = TTLCache(max_size=100000, ttl=max(60, burst / rate if rate > 0 else 60))
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+        # Re-set on every use so only idle buckets expire
+        self._buckets.set(user_id, bucket)
+        return bucket
+
+    def retry_after(self) -> int:
+        """
+        Rough time until the waiting queue has drained by one RunPod round.
+        """
+        rounds = max(1, math.ceil(self.waiting / max(1, self.max_running)))
+        return max(ADMISSION_MIN_RETRY_AFTER, math.ceil(runpod_poller.expected_runtime * rounds))
+
+    def _reject(self, message: str, retry_after: int):
+        self.rejected += 1
+        raise AdmissionRejectedError(message, retry_after)
+
+    def admit(self, user_id: int, jobs: int = 1) -> List[AdmissionTicket]:
+        """
+        Reserve room for jobs in the waiting queue, one ticket per job.
+        A request is one token however many jobs it carries.
+        Raises AdmissionRejectedError when the caller should back off.
+        """
+        if self.waiting + jobs > self.max_waiting:
+            self._reject("Generation queue is full, try again later", self.retry_after())
+        if self._user_waiting[user_id] + jobs > self.max_waiting_per_user:
+            self._reject("Too many pending generations, try again later", self.retry_after())
+
+        wait = self._bucket(user_id).try_acquire()
+        if wait:
+            self._reject("Generation rate limit exceeded", max(ADMISSION_MIN_RETRY_AFTER, math.ceil(wait)))
+
+        self.waiting += jobs
+        self._user_waiting[user_id] += jobs
+        return [AdmissionTicket(user_id=user_id) for _ in range(jobs)]
+
+    def has_slot(self, user_id: int) -> bool:
+        return self.running < self.max_running and self._user_running.get(user_id, 0) < self.max_running_per_user
+
+    def acquire(self, ticket: AdmissionTicket):
+        """
+        Move the ticket from waiting to running. Callers check has_slot() first.
+        """
+        self._leave_waiting(ticket)
+        ticket.state = "running"
+        self.running += 1
+        self._user_running[ticket.user_id] += 1
+
+    def _leave_waiting(self, ticket: AdmissionTicket):
+        if ticket.state != "waiting":
+            return
+        self.waiting -= 1
+        self._user_waiting[ticket.user_id] -= 1
+        if not self._user_waiting[ticket.user_id]:
+            del self._user_waiting[ticket.user_id]
+
+    def release(self, ticket: AdmissionTicket):
+        """
+        Give back whatever the ticket still holds. Safe to call more than once.
+        """
+        self._leave_waiting(ticket)
+        if ticket.state == "running":
+            self.running -= 1
+            self._user_running[ticket.user_id] -= 1
+            if not self._user_running[ticket.user_id]:
+                del self._user_running[ticket.user_id]
+        ticket.state = "done"
+
+    def release_unstarted(self, tickets: List[AdmissionTicket]):
+        """
+        Drop tickets whose jobs were never queued, e.g. when the request failed.
+        """
+        for ticket in tickets:
+            self._leave_waiting(ticket)
+            ticket.state = "done"
+
+    def accepting(self) -> bool:
+        return self.waiting < self.max_waiting
+
+    def stats(self) -> dict:
+        return {
+            "accepting": self.accepting(),
+            "waiting": self.waiting,
+            "max_waiting": self.max_waiting,
+            "running": self.running,
+            "max_running": self.max_running,
+            "max_running_per_user": self.max_running_per_user,
+            "max_waiting_per_user": self.max_waiting_per_user,
+            "rate": self.rate,
+            "burst": self.burst,
+            "rejected": self.rejected,
+            "retry_after": self.retry_after()
+        }
+
+# Create global instance
+admission_controller = AdmissionController()
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError
+
+from app.database import AsyncSessionLocal
+from app.models import GenerationCacheEntry
+
+load_dotenv()
+
+GENERATION_CACHE_ENABLED = os.getenv("GENERATION_CACHE_ENABLED", "false").lower() == "true"
+GENERATION_CACHE_TTL = int(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "1000"))
+
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache whose entries expire after ttl seconds.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+def generation_cache_key(prompt: str, reference_images: List[str]) -> str:
+    """
+    Key for a normalized prompt and the set of reference images. Reference
+    keys are content-addressed, so the same images produce the same key.
+    """
+    normalized_prompt = " ".join(prompt.split())
+    references = sorted(set(reference_images or []))
+    raw = json.dumps({"prompt": normalized_prompt, "references": references})
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class GenerationResultCache:
+    """
+    Generated image keys by request key: an in-memory LRU in front of the
+    generation_cache table.
+    """
+    def __init__(self, enabled: bool = GENERATION_CACHE_ENABLED, ttl: int = GENERATION_CACHE_TTL, max_size: int = GENERATION_CACHE_SIZE):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.memory = TTLCache(max_size=max_size, ttl=ttl)
+        self.db_hits = 0
+
+    async def get(self, cache_key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+
+        image_key = self.memory.get(cache_key)
+        if image_key is not None:
+            return image_key
+
+        async with AsyncSessionLocal() as db:
+            entry = await db.get(GenerationCacheEntry, cache_key)
+            if not entry:
+                return None
+
+            created_at = entry.created_at
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            remaining = (created_at + timedelta(seconds=self.ttl) - datetime.now(timezone.utc)).total_seconds()
+            if remaining <= 0:
+                await db.delete(entry)
+                await db.commit()
+                return None
+
+            self.db_hits += 1
+            self.memory.set(cache_key, entry.image_key, ttl=remaining)
+            return entry.image_key
+
+    async def set(self, cache_key: str, image_key: str):
+        if not self.enabled or not image_key:
+            return
+
+        self.memory.set(cache_key, image_key)
+        async with AsyncSessionLocal() as db:
+            try:
+                entry = await db.get(GenerationCacheEntry, cache_key)
+                if entry:
+                    entry.image_key = image_key
+                    entry.created_at = datetime.now(timezone.utc)
+                else:
+                    db.add(GenerationCacheEntry(cache_key=cache_key, image_key=image_key, created_at=datetime.now(timezone.utc)))
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "db_hits": self.db_hits, **self.memory.stats()}
+
+# Create global instance
+generation_cache = GenerationResultCache()
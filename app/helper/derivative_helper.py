@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from sqlalchemy import update
+from starlette.concurrency import run_in_threadpool
+from app.database import AsyncSessionLocal
+from app.helper.image_helper import image_processor, IMAGE_CONTENT_TYPES, IMAGE_EXTENSIONS
+from app.helper.metrics_helper import DERIVATIVE_SECONDS
+from app.helper.s3_helper import s3_helper
+from app.models import GenerationSession, GenerationAttempt
+
+load_dotenv()
+
+DERIVATIVES_ENABLED = os.getenv("DERIVATIVES_ENABLED", "true").lower() == "true"
+# WEBP or JPEG
+DERIVATIVE_FORMAT = os.getenv("DERIVATIVE_FORMAT", "webp").upper().replace("JPG", "JPEG")
+DERIVATIVE_QUALITY = int(os.getenv("DERIVATIVE_QUALITY", "80"))
+# Longest edge, in pixels
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+PREVIEW_SIZE = int(os.getenv("PREVIEW_SIZE", "1024"))
+# Outputs fetched and stored at once; rendering is further capped by the image pool
+DERIVATIVE_CONCURRENCY = int(os.getenv("DERIVATIVE_CONCURRENCY", "4"))
+DERIVATIVE_QUEUE_SIZE = int(os.getenv("DERIVATIVE_QUEUE_SIZE", "1000"))
+# Derivative keys never change content, so clients may cache them for good
+DERIVATIVE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class DerivativeJob:
+    attempt_id: int
+    session_id: int
+    output_path: str
+
+
+def derivative_keys(s3_key: str) -> Dict[str, str]:
+    """
+    Keys of an output's thumbnail and preview, stored beside the original:
+    image-generation/outputs/<id>.png -> image-generation/outputs/<id>_thumb.webp
+    """
+    base = os.path.splitext(s3_key)[0]
+    extension = IMAGE_EXTENSIONS[DERIVATIVE_FORMAT]
+    return {"thumbnail": f"{base}_thumb.{extension}", "preview": f"{base}_preview.{extension}"}
+
+
+class DerivativePipeline:
+    """
+    Produces thumbnails and previews of completed outputs in the background.
+    Jobs are queued after the attempt is committed, so generation never
+    waits on them; when the queue is full the job is dropped and the
+    listing keeps pointing at the full-size output. Each output is fetched
+    and rendered once: attempts that reuse an output (result cache hits)
+    get the keys already recorded for it. Rendered outputs are recorded as
+    derived objects of the output for the current derivative settings, so
+    that check is a primary key lookup.
+    """
+    def __init__(self, concurrency: int = DERIVATIVE_CONCURRENCY, queue_size: int = DERIVATIVE_QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._rendering: Dict[str, asyncio.Future] = {}
+        self.settings_tag = f"derivatives-{THUMBNAIL_SIZE}-{PREVIEW_SIZE}-{DERIVATIVE_FORMAT.lower()}-q{DERIVATIVE_QUALITY}"
+        self.rendered = 0
+        self.reused = 0
+        self.failed = 0
+        self.dropped = 0
+
+    async def start(self):
+        if not DERIVATIVES_ENABLED:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    def enqueue(self, attempt_id: int, session_id: int, output_path: Optional[str]) -> bool:
+        if self._queue is None or not output_path:
+            return False
+        try:
+            self._queue.put_nowait(DerivativeJob(attempt_id, session_id, output_path))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Derivative queue full, skipping thumbnails for attempt %s", attempt_id)
+            return False
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            started_at = time.perf_counter()
+            try:
+                outcome = await self.process(job)
+            except Exception:
+                outcome = "failed"
+                self.failed += 1
+                logger.exception("Failed to create thumbnails for attempt %s", job.attempt_id)
+            finally:
+                self._queue.task_done()
+            DERIVATIVE_SECONDS.labels(outcome).observe(time.perf_counter() - started_at)
+
+    async def process(self, job: DerivativeJob) -> str:
+        s3_key = s3_helper.key_for(job.output_path)
+        if s3_key is None:
+            # Hosted outside our bucket
+            return "skipped"
+
+        keys = await self._recorded_keys(s3_key)
+        if keys is not None:
+            self.reused += 1
+            outcome = "reused"
+        elif s3_key in self._rendering:
+            keys = await asyncio.shield(self._rendering[s3_key])
+            self.reused += 1
+            outcome = "reused"
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._rendering[s3_key] = future
+            try:
+                keys = await self._render(s3_key)
+                future.set_result(keys)
+            except Exception as e:
+                future.set_exception(e)
+                # Retrieved here so an unawaited failure is not logged again
+                future.exception()
+                raise
+            finally:
+                del self._rendering[s3_key]
+            self.rendered += 1
+            outcome = "rendered"
+
+        await self._record(job, keys)
+        return outcome
+
+    async def _render(self, s3_key: str) -> Dict[str, str]:
+        data = await run_in_threadpool(s3_helper.get_bytes, s3_key)
+        rendered = await image_processor.derivatives(
+            data,
+            {"thumbnail": THUMBNAIL_SIZE, "preview": PREVIEW_SIZE},
+            DERIVATIVE_FORMAT,
+            DERIVATIVE_QUALITY
+        )
+        keys = derivative_keys(s3_key)
+        await asyncio.gather(*[
+            run_in_threadpool(
+                s3_helper.put_bytes,
+                keys[name],
+                rendered[name],
+                IMAGE_CONTENT_TYPES[DERIVATIVE_FORMAT],
+                DERIVATIVE_CACHE_CONTROL
+            )
+            for name in keys
+        ])
+        await run_in_threadpool(
+            s3_helper.save_derived_object,
+            s3_key,
+            self.settings_tag,
+            keys["thumbnail"],
+            IMAGE_CONTENT_TYPES[DERIVATIVE_FORMAT]
+        )
+        return keys
+
+    async def _recorded_keys(self, s3_key: str) -> Optional[Dict[str, str]]:
+        recorded = await run_in_threadpool(s3_helper.find_derived_object, s3_key, self.settings_tag)
+        return derivative_keys(s3_key) if recorded is not None else None
+
+    async def _record(self, job: DerivativeJob, keys: Dict[str, str]):
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(GenerationAttempt)
+                .where(GenerationAttempt.id == job.attempt_id)
+                .values(thumbnail_key=keys["thumbnail"], preview_key=keys["preview"])
+            )
+            # Mirrored on the session while this is still its latest output
+            await db.execute(
+                update(GenerationSession)
+                .where(GenerationSession.session_id == job.session_id, GenerationSession.output_path == job.output_path)
+                .values(thumbnail_key=keys["thumbnail"], preview_key=keys["preview"])
+            )
+            await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": DERIVATIVES_ENABLED,
+            "queued": self.queue_depth(),
+            "rendering": len(self._rendering),
+            "rendered": self.rendered,
+            "reused": self.reused,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "image_pool": image_processor.stats()
+        }
+
+# Create global instance
+derivative_pipeline = DerivativePipeline()
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, Set
+
+from app.helper.cache_helper import TTLCache
+
+EVENT_QUEUE_SIZE = 32
+EVENT_KEEPALIVE_SECONDS = 15
+TERMINAL_STATES = ["completed", "failed"]
+
+
+class GenerationEventBus:
+    """
+    In-process fan-out of generation state changes to per-session subscribers.
+    Each subscriber is a small asyncio.Queue, so idle subscriptions cost
+    almost nothing.
+    """
+    def __init__(self):
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self._job_sessions: Dict[str, Set[int]] = defaultdict(set)
+        # Latest event per session, replayed to late subscribers
+        self._last_events = TTLCache(max_size=10000, ttl=3600)
+
+    def subscribe(self, session_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self._subscribers[session_id].add(queue)
+        return queue
+
+    def unsubscribe(self, session_id: int, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(session_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[session_id]
+
+    def last_event(self, session_id: int):
+        return self._last_events.get(session_id)
+
+    def publish(self, session_id: int, state: str, **data):
+        event = {"session_id": session_id, "state": state, "timestamp": time.time(), **data}
+        self._last_events.set(session_id, event)
+        for queue in self._subscribers.get(session_id, ()):
+            if queue.full():
+                # Slow consumer: drop its oldest event rather than block publishers
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def link_job(self, job_id: str, session_id: int):
+        self._job_sessions[job_id].add(session_id)
+
+    def unlink_job(self, job_id: str, session_id: int):
+        sessions = self._job_sessions.get(job_id)
+        if sessions is None:
+            return
+        sessions.discard(session_id)
+        if not sessions:
+            del self._job_sessions[job_id]
+
+    def publish_job(self, job_id: str, state: str, **data):
+        for session_id in list(self._job_sessions.get(job_id, ())):
+            self.publish(session_id, state, job_id=job_id, **data)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "linked_jobs": len(self._job_sessions)
+        }
+
+# Create global instance
+generation_events = GenerationEventBus()
+
+
+async def iter_session_events(session_id: int, queue: asyncio.Queue, initial: dict, keepalive: float):
+    """
+    Yield the initial event, then each published event until a terminal
+    state. Yields None every keepalive seconds while nothing happens.
+    """
+    try:
+        event = initial
+        yield event
+        while event["state"] not in TERMINAL_STATES:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            yield event
+    finally:
+        generation_events.unsubscribe(session_id, queue)
@@ -0,0 +1,118 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, Optional
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import GenerationSession, GenerationAttempt, User
+from app.helper.pagination_helper import filter_sessions
+
+EXPORT_BATCH_SIZE = 1000
+# Rows are sent in pieces of about this many characters rather than one by
+# one, since each piece is a separate write to the client
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_COLUMNS = [
+    "session_id",
+    "user_id",
+    "user_email",
+    "user_name",
+    "status",
+    "approved",
+    "session_created_at",
+    "attempt_number",
+    "prompt",
+    "reference_images",
+    "output_path",
+    "attempt_created_at"
+]
+
+
+def iter_activity_rows(
+    user_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+) -> Iterator[dict]:
+    """
+    One dict per generation attempt (or per session without attempts), read
+    from a server-side cursor in batches so memory stays flat.
+    """
+    query = select(
+        GenerationSession.session_id,
+        GenerationSession.user_id,
+        User.email,
+        User.firstname,
+        User.lastname,
+        GenerationSession.status,
+        GenerationSession.approved,
+        GenerationSession.created_at,
+        GenerationAttempt.attempt_number,
+        GenerationAttempt.prompt,
+        GenerationAttempt.reference_images,
+        GenerationAttempt.output_path,
+        GenerationAttempt.created_at.label("attempt_created_at")
+    ).join(
+        User, GenerationSession.user_id == User.user_id
+    ).outerjoin(
+        GenerationAttempt, GenerationAttempt.session_id == GenerationSession.session_id
+    )
+    query = filter_sessions(query, user_id=user_id, date_from=date_from, date_to=date_to)
+    query = query.order_by(
+        GenerationSession.created_at,
+        GenerationSession.session_id,
+        GenerationAttempt.attempt_number
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    db = SessionLocal()
+    try:
+        for row in db.execute(query):
+            yield {
+                "session_id": row.session_id,
+                "user_id": row.user_id,
+                "user_email": row.email,
+                "user_name": f"{row.firstname} {row.lastname}",
+                "status": row.status,
+                "approved": row.approved,
+                "session_created_at": row.created_at.isoformat() if row.created_at else None,
+                "attempt_number": row.attempt_number,
+                "prompt": row.prompt,
+                "reference_images": json.loads(row.reference_images) if row.reference_images else [],
+                "output_path": row.output_path,
+                "attempt_created_at": row.attempt_created_at.isoformat() if row.attempt_created_at else None
+            }
+    finally:
+        db.close()
+
+
+def iter_ndjson(rows: Iterator[dict]) -> Iterator[str]:
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(row) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield "".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield "".join(lines)
+
+
+def iter_csv(rows: Iterator[dict]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+
+    for row in rows:
+        row["reference_images"] = ";".join(row["reference_images"])
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    # Also sends the header when there are no rows
+    if buffer.tell():
+        yield buffer.getvalue()
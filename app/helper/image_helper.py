@@ -0,0 +1,127 @@
+import io
+import math
+import os
+from typing import Dict, Optional, Union
+from dotenv import load_dotenv
+from PIL import Image, ImageOps
+from app.helper.process_pool_helper import BoundedProcessPool, PoolBusyError
+
+load_dotenv()
+
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", str(min(2, os.cpu_count() or 1))))
+IMAGE_POOL_MAX_PENDING = int(os.getenv("IMAGE_POOL_MAX_PENDING", "64"))
+IMAGE_POOL_RETRY_AFTER = int(os.getenv("IMAGE_POOL_RETRY_AFTER", "2"))
+# Decompression bomb guard; Pillow's default warns at ~89M pixels
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(64 * 1024 * 1024)))
+
+# EXIF tag holding the camera orientation; 1 means upright
+EXIF_ORIENTATION = 0x0112
+
+IMAGE_CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+IMAGE_EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg", "PNG": "png"}
+
+
+class ImagePoolBusyError(PoolBusyError):
+    pass
+
+
+def _image_file(source: Union[bytes, str]):
+    return io.BytesIO(source) if isinstance(source, bytes) else source
+
+
+def open_image(source: Union[bytes, str], max_edge: Optional[int] = None) -> Image.Image:
+    """
+    Decode an image given as bytes or a file path, applying its EXIF
+    orientation. For JPEGs, max_edge lets the decoder scale down by up to
+    8x while decoding, which is much cheaper than decoding at full size
+    and resizing.
+    """
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    image = Image.open(_image_file(source))
+    if max_edge and image.format == "JPEG":
+        # The decoder only scales down while both edges stay at or above the requested size
+        scale = min(1.0, max_edge / max(image.size))
+        image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+    image = ImageOps.exif_transpose(image)
+    image.load()
+    return image
+
+
+def encode_image(image: Image.Image, image_format: str, quality: int) -> bytes:
+    if image_format == "JPEG" and image.mode != "RGB":
+        if image.mode in ("RGBA", "LA", "P") and (image.mode != "P" or "transparency" in image.info):
+            # Flatten transparency onto white rather than whatever the hidden pixels hold
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    output = io.BytesIO()
+    if image_format == "PNG":
+        image.save(output, format="PNG", optimize=True)
+    else:
+        # method=4 is WebP's speed/size default; JPEG ignores it
+        image.save(output, format=image_format, quality=quality, method=4)
+    return output.getvalue()
+
+
+def render_derivatives(data: bytes, sizes: Dict[str, int], image_format: str, quality: int) -> Dict[str, bytes]:
+    """
+    Downscaled copies of an image, one per name in sizes (longest edge in
+    pixels), largest first so each one is resized from the previous one.
+    Images are never upscaled.
+    """
+    ordered = sorted(sizes.items(), key=lambda item: item[1], reverse=True)
+    image = open_image(data, max_edge=ordered[0][1])
+    derivatives = {}
+    for name, max_edge in ordered:
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        derivatives[name] = encode_image(image, image_format, quality)
+    return derivatives
+
+
+def normalize_image(source: Union[bytes, str], max_edge: int, image_format: str, quality: int, min_bytes: int) -> Optional[bytes]:
+    """
+    Upright, downscaled and re-encoded copy of an uploaded image (bytes or
+    a file path), or None when the upload can be used as is: already
+    upright, within max_edge and no larger than min_bytes, or when
+    re-encoding would not shrink it.
+    """
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+    with Image.open(_image_file(source)) as image:
+        rotated = image.getexif().get(EXIF_ORIENTATION, 1) not in (0, 1)
+        oversized = max(image.size) > max_edge
+    if not rotated and not oversized and size <= min_bytes:
+        return None
+
+    image = open_image(source, max_edge=max_edge)
+    image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    normalized = encode_image(image, image_format, quality)
+    if not rotated and not oversized and len(normalized) >= size:
+        return None
+    return normalized
+
+
+class ImageProcessor(BoundedProcessPool):
+    """
+    Runs Pillow work in a dedicated, size-bounded process pool, so decoding
+    and resizing neither hold the GIL nor take threads from requests.
+    """
+    busy_error = ImagePoolBusyError
+    busy_message = "Too many images being processed, try again shortly"
+    span_name = "image"
+
+    def __init__(self, workers: int = IMAGE_POOL_WORKERS, max_pending: int = IMAGE_POOL_MAX_PENDING):
+        super().__init__(workers, max_pending)
+
+    async def derivatives(self, data: bytes, sizes: Dict[str, int], image_format: str, quality: int) -> Dict[str, bytes]:
+        return await self.run(render_derivatives, data, sizes, image_format, quality)
+
+    async def normalize(self, source: Union[bytes, str], max_edge: int, image_format: str, quality: int, min_bytes: int) -> Optional[bytes]:
+        return await self.run(normalize_image, source, max_edge, image_format, quality, min_bytes)
+
+# Create global instance
+image_processor = ImageProcessor()
@@ -0,0 +1,428 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+from dotenv import load_dotenv
+
+from sqlalchemy import select, update
+from app.database import AsyncSessionLocal
+from app.enums.generation_status import GenerationStatus
+from app.helper.runpod_helper import submit_job
+from app.helper.poller_helper import wait_for_output
+from app.helper.cache_helper import generation_cache, generation_cache_key
+from app.helper.singleflight_helper import runpod_singleflight
+from app.helper.events_helper import generation_events
+from app.helper.s3_helper import s3_helper
+from app.helper.derivative_helper import derivative_pipeline
+from app.helper.admission_helper import admission_controller, AdmissionTicket
+from app.helper.scheduler_helper import PriorityScheduler, ScheduledItem, default_class_caps, SCHEDULER_AGING_SECONDS
+from app.helper.timing_helper import RequestTiming, current_timing, log_if_slow, SLOW_JOB_THRESHOLD_SECONDS
+from app.enums.priority_class import PriorityClass
+from app.models import GenerationSession, GenerationAttempt
+
+load_dotenv()
+
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "16"))
+GENERATION_QUEUE_SIZE = int(os.getenv("GENERATION_QUEUE_SIZE", "100"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+BATCH_DEFAULT_PARALLELISM = int(os.getenv("BATCH_DEFAULT_PARALLELISM", "4"))
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", "16"))
+MAX_ACTIVE_BATCHES = int(os.getenv("MAX_ACTIVE_BATCHES", "10"))
+# Pick up sessions left pending or running by the previous process; turn off
+# when several app instances share one database
+GENERATION_RECOVER_ON_STARTUP = os.getenv("GENERATION_RECOVER_ON_STARTUP", "true").lower() == "true"
+INTERRUPTED_MESSAGE = "Generation was interrupted by a server restart, please try again"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class GenerationJob:
+    session_id: int
+    prompt: str
+    attempt_number: int
+    reference_image: Optional[str] = None
+    # Images sent to RunPod for this attempt
+    reference_images: List[str] = field(default_factory=list)
+    # Images recorded on the attempt (all images seen by the session so far)
+    stored_reference_images: List[str] = field(default_factory=list)
+    # Result cache entry to fill when the job completes
+    cache_key: Optional[str] = None
+    # Admission reservation; the job holds a RunPod slot through it from dispatch until it finishes
+    ticket: Optional[AdmissionTicket] = None
+    # Share one RunPod job with identical requests already in flight. Off
+    # when the caller wants a fresh image (no_cache, regenerate, repeated
+    # batch items)
+    coalesce: bool = True
+
+
+class SharedSubmission:
+    """
+    The sessions waiting on one RunPod submission: the single-flight
+    leader's and those of any followers. Each gets the submitted and
+    progress events, including followers that join after submission.
+    """
+    def __init__(self):
+        self.session_ids: Set[int] = set()
+        self.job_id: Optional[str] = None
+
+    def _link(self, session_id: int):
+        generation_events.publish(session_id, "submitted", job_id=self.job_id)
+        generation_events.link_job(self.job_id, session_id)
+
+    def join(self, session_id: int):
+        self.session_ids.add(session_id)
+        if self.job_id is not None:
+            self._link(session_id)
+
+    def submitted(self, job_id: str):
+        self.job_id = job_id
+        for session_id in self.session_ids:
+            self._link(session_id)
+
+    def leave(self, session_id: int):
+        self.session_ids.discard(session_id)
+        if self.job_id is not None:
+            generation_events.unlink_job(self.job_id, session_id)
+
+
+# Submissions in flight per single-flight key, so followers can join them
+shared_submissions: Dict[str, SharedSubmission] = {}
+
+
+async def record_generation_result(db, session: GenerationSession, job: GenerationJob, runpod_result: dict):
+    """
+    Write the outcome of a finished RunPod job onto its session and attempt.
+    """
+    if "error" in runpod_result:
+        session.status = GenerationStatus.FAILED.value
+        session.error_message = str(runpod_result["error"])
+        await db.commit()
+        generation_events.publish(session.session_id, GenerationStatus.FAILED.value, error=session.error_message)
+        return
+
+    generated_image_url = runpod_result.get("image_key", "")
+
+    session.output_path = generated_image_url
+    # The previous output's derivatives; the derivative pipeline records the new ones
+    session.thumbnail_key = None
+    session.preview_key = None
+    session.status = GenerationStatus.COMPLETED.value
+    attempt = GenerationAttempt(
+        session_id=session.session_id,
+        prompt=job.prompt,
+        reference_image=job.reference_image,
+        reference_images=json.dumps(job.stored_reference_images) if job.stored_reference_images else None,
+        output_path=generated_image_url,
+        attempt_number=job.attempt_number
+    )
+    db.add(attempt)
+    await db.commit()
+    derivative_pipeline.enqueue(attempt.id, session.session_id, generated_image_url)
+    generation_events.publish(
+        session.session_id,
+        GenerationStatus.COMPLETED.value,
+        image_key=generated_image_url,
+        image_url=s3_helper.download_url(generated_image_url),
+        attempt_number=job.attempt_number
+    )
+
+    if job.cache_key:
+        await generation_cache.set(job.cache_key, generated_image_url)
+
+
+async def run_generation_job(job: GenerationJob):
+    """
+    Drive one RunPod job for a pending session and record the outcome.
+    """
+    try:
+        await _run_generation_job(job)
+    finally:
+        if job.ticket:
+            admission_controller.release(job.ticket)
+
+
+async def _run_generation_job(job: GenerationJob):
+    async with AsyncSessionLocal() as db:
+        session = (await db.execute(
+            select(GenerationSession).where(GenerationSession.session_id == job.session_id)
+        )).scalar_one_or_none()
+        if not session:
+            return
+
+        session.status = GenerationStatus.RUNNING.value
+        session.error_message = None
+        await db.commit()
+
+        flight_key = generation_cache_key(job.prompt, job.reference_images) if job.coalesce else None
+        if flight_key is not None:
+            submission = shared_submissions.setdefault(flight_key, SharedSubmission())
+        else:
+            submission = SharedSubmission()
+
+        async def submit_and_wait():
+            try:
+                job_id = await submit_job(job.prompt, job.reference_images)
+                session.job_id = job_id
+                await db.commit()
+                submission.submitted(job_id)
+                return job_id, await wait_for_output(job_id)
+            finally:
+                # Later identical requests start a new flight, so they must not join this one
+                if flight_key is not None and shared_submissions.get(flight_key) is submission:
+                    del shared_submissions[flight_key]
+
+        submission.join(session.session_id)
+        try:
+            if flight_key is not None:
+                # Identical requests running at the same time share one RunPod job
+                job_id, runpod_result = await runpod_singleflight.do(flight_key, submit_and_wait)
+            else:
+                job_id, runpod_result = await submit_and_wait()
+            if session.job_id != job_id:
+                session.job_id = job_id
+                await db.commit()
+        except Exception as e:
+            runpod_result = {"error": str(e)}
+        finally:
+            submission.leave(session.session_id)
+
+        # A webhook for an untracked job may already have recorded the result
+        await db.refresh(session)
+        if session.status != GenerationStatus.RUNNING.value:
+            return
+
+        await record_generation_result(db, session, job, runpod_result)
+
+
+async def finish_untracked_job(job_id: str, runpod_result: dict) -> bool:
+    """
+    Record a webhook result for a job no worker is waiting on, e.g. after a restart.
+    """
+    async with AsyncSessionLocal() as db:
+        session = (await db.execute(
+            select(GenerationSession).where(
+                GenerationSession.job_id == job_id,
+                GenerationSession.status == GenerationStatus.RUNNING.value
+            )
+        )).scalars().first()
+        if not session:
+            return False
+
+        job = GenerationJob(
+            session_id=session.session_id,
+            prompt=session.input_prompt,
+            attempt_number=session.attempts,
+            reference_image=session.reference_image,
+            stored_reference_images=json.loads(session.reference_images) if session.reference_images else []
+        )
+        await record_generation_result(db, session, job, runpod_result)
+        return True
+
+
+async def resume_runpod_job(session_id: int, job_id: str):
+    """
+    Wait again for a RunPod job submitted before a restart and record its result.
+    """
+    generation_events.link_job(job_id, session_id)
+    try:
+        runpod_result = await wait_for_output(job_id)
+    finally:
+        generation_events.unlink_job(job_id, session_id)
+    await finish_untracked_job(job_id, runpod_result)
+
+
+async def recover_interrupted_sessions() -> List[GenerationSession]:
+    """
+    Fail sessions whose queued job was lost with the previous process and
+    return the running ones that still have a RunPod job to wait for.
+    """
+    active = [GenerationStatus.PENDING.value, GenerationStatus.RUNNING.value]
+    async with AsyncSessionLocal() as db:
+        # Not yet submitted: nothing at RunPod to pick up, and the request
+        # that queued it is gone
+        failed = await db.execute(
+            update(GenerationSession)
+            .where(
+                GenerationSession.status.in_(active),
+                (GenerationSession.status == GenerationStatus.PENDING.value) | GenerationSession.job_id.is_(None)
+            )
+            .values(status=GenerationStatus.FAILED.value, error_message=INTERRUPTED_MESSAGE)
+        )
+        await db.commit()
+        resumable = (await db.execute(
+            select(GenerationSession).where(GenerationSession.status == GenerationStatus.RUNNING.value)
+        )).scalars().all()
+
+    if failed.rowcount or resumable:
+        logger.warning(
+            "Recovered interrupted generations: %d failed, %d resumed", failed.rowcount, len(resumable)
+        )
+    return resumable
+
+
+class GenerationWorkerPool:
+    """
+    Bounded in-process pool that runs queued generation jobs in priority
+    order. Each priority class may occupy at most its cap of the workers
+    and each batch at most its own parallelism. Jobs whose user (or the
+    whole service) is at its RunPod limit stay queued, so they never hold
+    a worker that another user's job could run on.
+    """
+    def __init__(self, workers: int = GENERATION_WORKERS, max_queue: int = GENERATION_QUEUE_SIZE, aging: float = SCHEDULER_AGING_SECONDS):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.class_caps = default_class_caps(workers)
+        self._scheduler = PriorityScheduler(aging=aging)
+        self._running: Dict[PriorityClass, int] = {priority_class: 0 for priority_class in PriorityClass}
+        self._tasks: Set[asyncio.Task] = set()
+        # RunPod jobs picked up after a restart; they do not take workers
+        self._resumed: Set[asyncio.Task] = set()
+        self._batch_ids = itertools.count(1)
+        self._batch_limits: Dict[int, int] = {}
+        self._batch_running: Dict[int, int] = {}
+        self._batch_remaining: Dict[int, int] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def recover(self):
+        if not GENERATION_RECOVER_ON_STARTUP:
+            return
+        for session in await recover_interrupted_sessions():
+            task = asyncio.create_task(resume_runpod_job(session.session_id, session.job_id))
+            self._resumed.add(task)
+            task.add_done_callback(self._resumed_finished)
+
+    def _resumed_finished(self, task: asyncio.Task):
+        self._resumed.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Resumed generation job crashed", exc_info=task.exception())
+
+    async def stop(self):
+        tasks = list(self._tasks) + list(self._resumed) + ([self._dispatcher] if self._dispatcher else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        admission_controller.release_unstarted([
+            scheduled.item.ticket for scheduled in self._scheduler.drain() if scheduled.item.ticket
+        ])
+        self._dispatcher = None
+        self._wakeup = None
+
+    def _interactive_depth(self) -> int:
+        return sum(
+            self._scheduler.size(priority_class)
+            for priority_class in [PriorityClass.ADMIN_INTERACTIVE, PriorityClass.USER_INTERACTIVE]
+        )
+
+    def is_full(self) -> bool:
+        return self._wakeup is None or self._interactive_depth() >= self.max_queue
+
+    def enqueue(self, job: GenerationJob, priority_class: PriorityClass = PriorityClass.USER_INTERACTIVE):
+        """
+        Queue a job; raises asyncio.QueueFull when the pool is saturated.
+        """
+        if self.is_full():
+            raise asyncio.QueueFull()
+        self._scheduler.push(job, priority_class)
+        self._wakeup.set()
+
+    def can_start_batch(self) -> bool:
+        return self._wakeup is not None and len(self._batch_remaining) < MAX_ACTIVE_BATCHES
+
+    def start_batch(self, jobs: List[GenerationJob], parallelism: int, priority_class: PriorityClass = PriorityClass.USER_BATCH):
+        """
+        Queue a batch's jobs; at most parallelism of them run at once.
+        """
+        batch = next(self._batch_ids)
+        self._batch_limits[batch] = parallelism
+        self._batch_running[batch] = 0
+        self._batch_remaining[batch] = len(jobs)
+        for job in jobs:
+            self._scheduler.push(job, priority_class, group=batch)
+        self._wakeup.set()
+
+    def active_batches(self) -> int:
+        return len(self._batch_remaining)
+
+    def queue_depth(self) -> int:
+        return self._scheduler.size()
+
+    def class_stats(self) -> dict:
+        return {
+            priority_class.name.lower(): {
+                "queued": self._scheduler.size(priority_class),
+                "running": self._running[priority_class],
+                "cap": self.class_caps[priority_class],
+                "oldest_wait": round(self._scheduler.oldest_wait(priority_class), 2)
+            }
+            for priority_class in PriorityClass
+        }
+
+    def _can_run(self, scheduled: ScheduledItem) -> bool:
+        if self._running[scheduled.priority_class] >= self.class_caps[scheduled.priority_class]:
+            return False
+        ticket = scheduled.item.ticket
+        if ticket is not None and not admission_controller.has_slot(ticket.user_id):
+            return False
+        if scheduled.group is not None:
+            return self._batch_running[scheduled.group] < self._batch_limits[scheduled.group]
+        return True
+
+    async def _dispatch(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while len(self._tasks) < self.workers:
+                scheduled = self._scheduler.pop_next(self._can_run)
+                if scheduled is None:
+                    break
+                self._launch(scheduled)
+
+    def _launch(self, scheduled: ScheduledItem):
+        self._running[scheduled.priority_class] += 1
+        if scheduled.group is not None:
+            self._batch_running[scheduled.group] += 1
+        if scheduled.item.ticket is not None:
+            admission_controller.acquire(scheduled.item.ticket)
+
+        task = asyncio.create_task(self._run(scheduled))
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._finished(done, scheduled))
+
+    async def _run(self, scheduled: ScheduledItem):
+        job = scheduled.item
+        # Each task runs in its own copy of the context, so this timing is the job's own
+        timing = RequestTiming()
+        timing.add("queue", time.monotonic() - scheduled.enqueued_at)
+        current_timing.set(timing)
+        try:
+            await run_generation_job(job)
+        except Exception:
+            logger.exception("Generation job for session %s crashed", job.session_id)
+        finally:
+            log_if_slow(f"generation job for session {job.session_id}", timing, SLOW_JOB_THRESHOLD_SECONDS)
+
+    def _finished(self, task: asyncio.Task, scheduled: ScheduledItem):
+        self._tasks.discard(task)
+        self._running[scheduled.priority_class] -= 1
+        if scheduled.group is not None:
+            self._batch_running[scheduled.group] -= 1
+            self._batch_remaining[scheduled.group] -= 1
+            if not self._batch_remaining[scheduled.group]:
+                del self._batch_limits[scheduled.group]
+                del self._batch_running[scheduled.group]
+                del self._batch_remaining[scheduled.group]
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+# Create global instance
+generation_pool = GenerationWorkerPool()
@@ -0,0 +1,71 @@
+import time
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from app.helper.timing_helper import record_span
+
+# Latency buckets, in seconds, for calls that usually take milliseconds
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# For waits on RunPod, which take from seconds to many minutes
+WAIT_BUCKETS = (1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600, 1200)
+BYTES_BUCKETS = (1024, 16 * 1024, 128 * 1024, 512 * 1024, 1024 ** 2, 4 * 1024 ** 2, 16 * 1024 ** 2, 64 * 1024 ** 2)
+
+RUNPOD_SUBMIT_SECONDS = Histogram(
+    "runpod_submit_seconds", "Latency of RunPod submit_job calls", ["outcome"], buckets=FAST_BUCKETS
+)
+RUNPOD_WAIT_SECONDS = Histogram(
+    "runpod_wait_seconds", "Time from submission until a RunPod job's output arrived", ["outcome"], buckets=WAIT_BUCKETS
+)
+RUNPOD_POLLS = Histogram(
+    "runpod_polls_per_job", "Status calls made for each finished RunPod job", buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+S3_UPLOAD_SECONDS = Histogram(
+    "s3_upload_seconds", "Duration of S3Helper.upload_file, hashing included", ["deduplicated"], buckets=FAST_BUCKETS
+)
+S3_UPLOAD_BYTES = Histogram(
+    "s3_upload_bytes", "Size of files passed to S3Helper.upload_file", ["deduplicated"], buckets=BYTES_BUCKETS
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"], buckets=FAST_BUCKETS + (30, 60, 120)
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served")
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries", "Database queries issued per request", ["route"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+)
+HTTP_REQUEST_DB_SECONDS = Histogram(
+    "http_request_db_seconds", "Time spent in database queries per request", ["route"], buckets=FAST_BUCKETS
+)
+DERIVATIVE_SECONDS = Histogram(
+    "image_derivative_seconds", "Time to fetch an output and store its thumbnail and preview", ["outcome"], buckets=FAST_BUCKETS
+)
+REFERENCE_IMAGE_BYTES = Counter(
+    "reference_image_bytes", "Reference image bytes received from clients and stored after normalization", ["stage"]
+)
+DB_QUERIES = Counter("db_queries_total", "Database queries executed")
+DB_QUERY_SECONDS = Histogram("db_query_seconds", "Database query latency", buckets=FAST_BUCKETS)
+
+
+def instrument_engine(engine):
+    """
+    Count and time every query on a (sync) engine; for an AsyncEngine pass
+    its sync_engine.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_started_at = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started_at
+        DB_QUERIES.inc()
+        DB_QUERY_SECONDS.observe(elapsed)
+        record_span("db", elapsed)
+
+
+def register_gauge(name: str, description: str, value):
+    """
+    Gauge whose value is read from a callable at scrape time, so the hot
+    path does no bookkeeping for it.
+    """
+    gauge = Gauge(name, description)
+    gauge.set_function(value)
+    return gauge
@@ -0,0 +1,85 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from app.models import GenerationSession, User
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(created_at: datetime, session_id: int) -> str:
+    raw = json.dumps([created_at.isoformat() if created_at else None, session_id])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    Decode a cursor into (created_at, session_id); raises ValueError if malformed.
+    """
+    try:
+        created_at, session_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(created_at), int(session_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def filter_sessions(
+    query,
+    user_id: Optional[int] = None,
+    approved: Optional[bool] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+):
+    if user_id is not None:
+        query = query.filter(GenerationSession.user_id == user_id)
+    if approved is not None:
+        query = query.filter(GenerationSession.approved == approved)
+    if date_from is not None:
+        query = query.filter(GenerationSession.created_at >= date_from)
+    if date_to is not None:
+        query = query.filter(GenerationSession.created_at < date_to)
+    return query
+
+
+def paginate_sessions(
+    db: Session,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    user_id: Optional[int] = None,
+    approved: Optional[bool] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None
+) -> tuple:
+    """
+    One page of (GenerationSession, User) rows, newest first, and the cursor
+    for the next page (None on the last page).
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = db.query(GenerationSession, User).join(User, GenerationSession.user_id == User.user_id)
+    query = filter_sessions(query, user_id, approved, date_from, date_to)
+
+    if cursor:
+        cursor_created_at, cursor_session_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            GenerationSession.created_at < cursor_created_at,
+            and_(
+                GenerationSession.created_at == cursor_created_at,
+                GenerationSession.session_id < cursor_session_id
+            )
+        ))
+
+    rows = query.order_by(
+        GenerationSession.created_at.desc(),
+        GenerationSession.session_id.desc()
+    ).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_session = rows[-1][0]
+        next_cursor = encode_cursor(last_session.created_at, last_session.session_id)
+    return rows, next_cursor
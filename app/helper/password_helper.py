@@ -0,0 +1,63 @@
+import os
+from typing import Optional
+import bcrypt
+from dotenv import load_dotenv
+from app.helper.process_pool_helper import BoundedProcessPool, PoolBusyError
+
+load_dotenv()
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_POOL_MAX_PENDING = int(os.getenv("PASSWORD_POOL_MAX_PENDING", "64"))
+PASSWORD_POOL_RETRY_AFTER = int(os.getenv("PASSWORD_POOL_RETRY_AFTER", "2"))
+
+
+class PasswordPoolBusyError(PoolBusyError):
+    pass
+
+
+def hash_password_bytes(password: bytes, rounds: int) -> str:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+
+def check_password_bytes(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    """
+    Cost factor of a bcrypt hash such as $2b$12$...
+    """
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher(BoundedProcessPool):
+    """
+    Runs bcrypt in a dedicated, size-bounded process pool so login bursts
+    cannot starve the threads other endpoints need.
+    """
+    busy_error = PasswordPoolBusyError
+    busy_message = "Too many authentication requests, try again shortly"
+    span_name = "password"
+
+    def __init__(self, workers: int = PASSWORD_POOL_WORKERS, max_pending: int = PASSWORD_POOL_MAX_PENDING, rounds: int = BCRYPT_ROUNDS):
+        super().__init__(workers, max_pending)
+        self.rounds = rounds
+
+    async def hash(self, password: bytes) -> str:
+        return await self.run(hash_password_bytes, password, self.rounds)
+
+    async def verify(self, password: bytes, hashed_password: str) -> bool:
+        return await self.run(check_password_bytes, password, hashed_password.encode('utf-8'))
+
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return hash_rounds(hashed_password) != self.rounds
+
+    def stats(self) -> dict:
+        return {**super().stats(), "rounds": self.rounds}
+
+# Create global instance
+password_hasher = PasswordHasher()
@@ -0,0 +1,283 @@
+import asyncio, heapq, time
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+from dotenv import load_dotenv
+
+from app.helper.runpod_helper import runpod_client, RUNPOD_JOB_TIMEOUT, RUNPOD_WEBHOOK_URL
+from app.helper.events_helper import generation_events
+from app.helper.metrics_helper import RUNPOD_POLLS, RUNPOD_WAIT_SECONDS
+from app.helper.timing_helper import record_span
+
+load_dotenv()
+
+RUNPOD_EXPECTED_RUNTIME = float(os.getenv("RUNPOD_EXPECTED_RUNTIME", "30"))
+RUNPOD_POLL_MIN = float(os.getenv("RUNPOD_POLL_MIN", "1"))
+RUNPOD_POLL_MAX = float(os.getenv("RUNPOD_POLL_MAX", "5"))
+# Each check waits this many times longer than the one before
+RUNPOD_POLL_BACKOFF = float(os.getenv("RUNPOD_POLL_BACKOFF", "1.5"))
+RUNPOD_STATUS_RATE = float(os.getenv("RUNPOD_STATUS_RATE", "20"))  # status calls per second
+RUNPOD_POLL_CONCURRENCY = int(os.getenv("RUNPOD_POLL_CONCURRENCY", "20"))
+# Safety-net polling interval for jobs that should report back through the webhook
+RUNPOD_WEBHOOK_FALLBACK_POLL = float(os.getenv("RUNPOD_WEBHOOK_FALLBACK_POLL", "60"))
+
+FAILED_STATES = ["FAILED", "CANCELLED", "TIMED_OUT"]
+
+logger = logging.getLogger(__name__)
+
+
+def result_from_status(status: dict) -> Optional[dict]:
+    """
+    Map a RunPod status payload to a job result, or None while it is still running.
+    """
+    state = status.get("status")
+    if state == "COMPLETED":
+        return status.get("output") or {}
+    elif state in FAILED_STATES:
+        return {"error": f"RunPod job {state.lower()}"}
+    return None
+
+
+@dataclass
+class TrackedJob:
+    job_id: str
+    future: asyncio.Future
+    submitted_at: float
+    deadline: float
+    polls: int = 0
+    # Fixed interval between checks; None backs off from RUNPOD_POLL_MIN
+    poll_interval: Optional[float] = None
+    # Delay before the most recent check
+    interval: float = 0
+    last_state: Optional[str] = None
+
+
+class RunPodPoller:
+    """
+    One status poller for every in-flight RunPod job.
+
+    Jobs are first checked after RUNPOD_POLL_MIN and then back off towards
+    a cap derived from the expected runtime, total status calls are capped at RUNPOD_STATUS_RATE per second,
+    and each caller awaits a future that is resolved when its job finishes.
+    """
+    def __init__(
+        self,
+        expected_runtime: float = RUNPOD_EXPECTED_RUNTIME,
+        max_calls_per_second: float = RUNPOD_STATUS_RATE,
+        concurrency: int = RUNPOD_POLL_CONCURRENCY
+    ):
+        self.expected_runtime = expected_runtime
+        self.max_calls_per_second = max_calls_per_second
+        self.concurrency = concurrency
+        self._jobs: Dict[str, TrackedJob] = {}
+        self._schedule: List[Tuple[float, str]] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        # Running status checks; the loop only keeps weak references to tasks
+        self._checks: Set[asyncio.Task] = set()
+        self._next_call_at = 0.0
+        # Webhook results that arrived before anyone started waiting on the job
+        self._early_results: Dict[str, Tuple[float, dict]] = {}
+        self.status_calls = 0
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for check in self._checks:
+            check.cancel()
+        await asyncio.gather(*self._checks, return_exceptions=True)
+        self._checks.clear()
+        for job in self._jobs.values():
+            if not job.future.done():
+                job.future.cancel()
+        self._jobs.clear()
+        self._schedule.clear()
+        self._early_results.clear()
+
+    def in_flight(self) -> int:
+        return len(self._jobs)
+
+    def _next_interval(self, previous: Optional[float] = None) -> float:
+        if previous is None:
+            return RUNPOD_POLL_MIN
+        # Short jobs are never left waiting long for their next check
+        cap = min(RUNPOD_POLL_MAX, max(RUNPOD_POLL_MIN, self.expected_runtime / 4))
+        return min(cap, previous * RUNPOD_POLL_BACKOFF)
+
+    def _schedule_check(self, job_id: str, at: float):
+        heapq.heappush(self._schedule, (at, job_id))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def track(self, job_id: str, timeout: float = RUNPOD_JOB_TIMEOUT, poll_interval: Optional[float] = None) -> asyncio.Future:
+        """
+        Start tracking a submitted job and return the future its result resolves.
+        """
+        self._ensure_running()
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job.future
+
+        now = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        early = self._early_results.pop(job_id, None)
+        if early is not None:
+            future.set_result(early[1])
+            return future
+
+        job = TrackedJob(
+            job_id=job_id,
+            future=future,
+            submitted_at=now,
+            deadline=now + timeout,
+            poll_interval=poll_interval
+        )
+        self._jobs[job_id] = job
+        job.interval = poll_interval if poll_interval is not None else self._next_interval()
+        self._schedule_check(job_id, min(now + job.interval, job.deadline))
+        return job.future
+
+    def untrack(self, job_id: str):
+        self._jobs.pop(job_id, None)
+
+    def resolve(self, job_id: str, status: dict) -> bool:
+        """
+        Finish a tracked job from a RunPod status payload. Returns False while
+        the job is still running or if it is not tracked.
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+
+        result = result_from_status(status)
+        if result is None:
+            return False
+
+        if status.get("status") == "COMPLETED":
+            # Learn the typical runtime so future jobs are polled around it
+            runtime = time.monotonic() - job.submitted_at
+            self.expected_runtime = 0.8 * self.expected_runtime + 0.2 * runtime
+
+        self._jobs.pop(job_id, None)
+        RUNPOD_POLLS.observe(job.polls)
+        if not job.future.done():
+            job.future.set_result(result)
+        return True
+
+    def remember(self, job_id: str, status: dict):
+        """
+        Keep a finished job's status for a caller that has not started waiting yet.
+        """
+        result = result_from_status(status)
+        if result is None:
+            return
+        now = time.monotonic()
+        for stale_id, (received_at, _) in list(self._early_results.items()):
+            if now - received_at > RUNPOD_JOB_TIMEOUT:
+                del self._early_results[stale_id]
+        self._early_results[job_id] = (now, result)
+
+    async def wait(self, job_id: str, timeout: float = RUNPOD_JOB_TIMEOUT, poll_interval: Optional[float] = None) -> dict:
+        future = self.track(job_id, timeout=timeout, poll_interval=poll_interval)
+        try:
+            return await asyncio.shield(future)
+        finally:
+            if not future.done():
+                self.untrack(job_id)
+
+    async def _run(self):
+        while True:
+            if not self._schedule:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            due_at, job_id = self._schedule[0]
+            now = time.monotonic()
+            if due_at > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=due_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._schedule)
+            job = self._jobs.get(job_id)
+            if job is None:
+                continue
+
+            # Space status calls evenly to stay under the global rate cap
+            now = time.monotonic()
+            if self._next_call_at > now:
+                await asyncio.sleep(self._next_call_at - now)
+            self._next_call_at = max(now, self._next_call_at) + 1 / self.max_calls_per_second
+
+            await self._semaphore.acquire()
+            check = asyncio.create_task(self._check(job))
+            self._checks.add(check)
+            check.add_done_callback(self._checks.discard)
+
+    async def _check(self, job: TrackedJob):
+        try:
+            if self._jobs.get(job.job_id) is not job:
+                return
+
+            try:
+                status = await runpod_client.check_status(job.job_id)
+                self.status_calls += 1
+                job.polls += 1
+                if self.resolve(job.job_id, status):
+                    return
+
+                state = status.get("status")
+                if state != job.last_state:
+                    job.last_state = state
+                    generation_events.publish_job(job.job_id, "in_progress", runpod_status=state)
+            except Exception as e:
+                logger.warning("RunPod status check for %s failed: %s", job.job_id, e)
+
+            now = time.monotonic()
+            if now >= job.deadline:
+                self._jobs.pop(job.job_id, None)
+                RUNPOD_POLLS.observe(job.polls)
+                await runpod_client.cancel_job(job.job_id)
+                if not job.future.done():
+                    job.future.set_result({"error": f"RunPod job timed out after {job.deadline - job.submitted_at:.0f}s"})
+                return
+
+            if job.poll_interval is None:
+                job.interval = self._next_interval(job.interval)
+            self._schedule_check(job.job_id, min(now + job.interval, job.deadline))
+        finally:
+            self._semaphore.release()
+
+# Create global instance
+runpod_poller = RunPodPoller()
+
+
+async def wait_for_output(job_id):
+    started_at = time.perf_counter()
+    outcome = "error"
+    try:
+        if RUNPOD_WEBHOOK_URL:
+            # Completion normally arrives through the webhook; only poll slowly as a fallback
+            result = await runpod_poller.wait(job_id, poll_interval=RUNPOD_WEBHOOK_FALLBACK_POLL)
+        else:
+            result = await runpod_poller.wait(job_id)
+        outcome = "error" if "error" in result else "completed"
+        return result
+    finally:
+        elapsed = time.perf_counter() - started_at
+        RUNPOD_WAIT_SECONDS.labels(outcome).observe(elapsed)
+        record_span("runpod_wait", elapsed)
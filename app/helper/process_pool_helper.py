@@ -0,0 +1,61 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from app.helper.timing_helper import span
+
+
+class PoolBusyError(Exception):
+    pass
+
+
+class BoundedProcessPool:
+    """
+    Dedicated process pool for CPU-bound work, started on first use.
+    At most max_pending calls may be queued or running; beyond that calls
+    fail fast with busy_error instead of piling up behind the workers.
+    Subclasses set the error, its message and the timing span name.
+    """
+    busy_error = PoolBusyError
+    busy_message = "Too many requests being processed, try again shortly"
+    span_name = "process_pool"
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise self.busy_error(self.busy_message)
+        self.pending += 1
+        try:
+            with span(self.span_name):
+                return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected
+        }
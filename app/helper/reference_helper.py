@@ -0,0 +1,235 @@
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+from typing import List, Optional, Union
+from dotenv import load_dotenv
+from fastapi import UploadFile
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from app.helper.image_helper import ImageProcessor, IMAGE_CONTENT_TYPES, IMAGE_EXTENSIONS
+from app.helper.metrics_helper import REFERENCE_IMAGE_BYTES
+from app.helper.s3_helper import s3_helper, InvalidUploadError, HASH_CHUNK_SIZE
+
+load_dotenv()
+
+# Normalize reference images before they are stored and sent to RunPod
+REFERENCE_NORMALIZE_ENABLED = os.getenv("REFERENCE_NORMALIZE_ENABLED", "false").lower() == "true"
+REFERENCE_MAX_EDGE = int(os.getenv("REFERENCE_MAX_EDGE", "2048"))
+# JPEG or WEBP
+REFERENCE_FORMAT = os.getenv("REFERENCE_FORMAT", "jpeg").upper().replace("JPG", "JPEG")
+REFERENCE_QUALITY = int(os.getenv("REFERENCE_QUALITY", "90"))
+# Upright images within REFERENCE_MAX_EDGE and this size are stored as uploaded
+REFERENCE_NORMALIZE_MIN_BYTES = int(os.getenv("REFERENCE_NORMALIZE_MIN_BYTES", str(1024 * 1024)))
+# Also store the untouched upload under REFERENCE_ORIGINALS_FOLDER
+REFERENCE_KEEP_ORIGINAL = os.getenv("REFERENCE_KEEP_ORIGINAL", "false").lower() == "true"
+REFERENCE_ORIGINALS_FOLDER = "image-generation/originals"
+REFERENCE_POOL_WORKERS = int(os.getenv("REFERENCE_POOL_WORKERS", str(min(2, os.cpu_count() or 1))))
+
+
+def bytes_upload(data: bytes, filename: str, content_type: str) -> UploadFile:
+    return UploadFile(
+        file=io.BytesIO(data),
+        size=len(data),
+        filename=filename,
+        headers=Headers({"content-type": content_type})
+    )
+
+
+def spool_to_disk(fileobj) -> str:
+    """
+    Copy an upload to a named temporary file, so a pool worker can open it
+    itself instead of the whole image being read here and sent over the
+    pool's pipe. The caller deletes the file.
+    """
+    fileobj.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="reference-", delete=False) as spooled:
+        shutil.copyfileobj(fileobj, spooled, HASH_CHUNK_SIZE)
+    return spooled.name
+
+
+def spool_object(s3_key: str) -> str:
+    """
+    Download an object to a named temporary file, for the same reason as
+    spool_to_disk. The caller deletes the file.
+    """
+    with tempfile.NamedTemporaryFile(prefix="reference-", delete=False) as spooled:
+        try:
+            s3_helper.download_to_file(s3_key, spooled)
+        except Exception:
+            spooled.close()
+            os.unlink(spooled.name)
+            raise
+    return spooled.name
+
+
+class ReferenceNormalizer:
+    """
+    Turns uploaded reference images (often 20-40 MB phone photos) into
+    upright, downscaled JPEG/WebP before they are stored, so S3, RunPod
+    workers and preprocessing all handle the smaller image. Decoding runs
+    in its own process pool, apart from the background thumbnail work, so
+    uploads never queue behind it. Each distinct upload is normalized
+    once: the result is recorded as a derived object of the upload's
+    content hash (or, for direct uploads, its S3 key) for the current
+    normalization settings.
+    """
+    def __init__(self, enabled: bool = REFERENCE_NORMALIZE_ENABLED, workers: int = REFERENCE_POOL_WORKERS):
+        self.enabled = enabled
+        self.processor = ImageProcessor(workers=workers)
+        self.settings_tag = f"normalized-{REFERENCE_MAX_EDGE}-{REFERENCE_FORMAT.lower()}-q{REFERENCE_QUALITY}"
+        self.normalized = 0
+        self.unchanged = 0
+        self.reused = 0
+
+    def shutdown(self):
+        self.processor.shutdown()
+
+    async def _normalize(self, source: Union[bytes, str]) -> Optional[bytes]:
+        try:
+            return await self.processor.normalize(
+                source, REFERENCE_MAX_EDGE, REFERENCE_FORMAT, REFERENCE_QUALITY, REFERENCE_NORMALIZE_MIN_BYTES
+            )
+        except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+            raise InvalidUploadError("Reference image could not be read as an image")
+
+    def _filename(self, name: str) -> str:
+        return f"{os.path.splitext(name or 'reference')[0]}.{IMAGE_EXTENSIONS[REFERENCE_FORMAT]}"
+
+    async def store_upload(self, file: UploadFile, folder: str) -> dict:
+        """
+        Store an uploaded reference image, normalized when enabled. Same
+        result shape as S3Helper.upload_file, plus original_s3_key when the
+        original is kept. S3Helper.upload_file closes the upload's file
+        object once it has been stored; callers still close the UploadFile.
+        """
+        if not self.enabled:
+            return await s3_helper.upload_file_async(file, folder=folder)
+
+        content_hash = await run_in_threadpool(s3_helper.hash_file, file.file)
+        received = file.file.tell()
+        REFERENCE_IMAGE_BYTES.labels("received").inc(received)
+        normalized_key = await run_in_threadpool(s3_helper.find_derived_object, content_hash, self.settings_tag)
+        if normalized_key is not None:
+            self.reused += 1
+            original = None
+            if REFERENCE_KEEP_ORIGINAL:
+                file.file.seek(0)
+                original = await s3_helper.upload_file_async(file, folder=REFERENCE_ORIGINALS_FOLDER)
+            return {
+                "s3_key": normalized_key,
+                "url": s3_helper.object_url(normalized_key),
+                "deduplicated": True,
+                "original_s3_key": original["s3_key"] if original else None
+            }
+
+        spooled_path = await run_in_threadpool(spool_to_disk, file.file)
+        try:
+            normalized = await self._normalize(spooled_path)
+        finally:
+            os.unlink(spooled_path)
+        file.file.seek(0)
+
+        if normalized is None:
+            self.unchanged += 1
+            REFERENCE_IMAGE_BYTES.labels("stored").inc(received)
+            stored = await s3_helper.upload_file_async(file, folder=folder)
+            await run_in_threadpool(
+                s3_helper.save_derived_object, content_hash, self.settings_tag, stored["s3_key"], file.content_type
+            )
+            return stored
+
+        self.normalized += 1
+        REFERENCE_IMAGE_BYTES.labels("stored").inc(len(normalized))
+        original = None
+        if REFERENCE_KEEP_ORIGINAL:
+            original = await s3_helper.upload_file_async(file, folder=REFERENCE_ORIGINALS_FOLDER)
+
+        stored = await s3_helper.upload_file_async(
+            bytes_upload(normalized, self._filename(file.filename), IMAGE_CONTENT_TYPES[REFERENCE_FORMAT]),
+            folder=folder,
+            metadata={"original-key": original["s3_key"]} if original else None
+        )
+        await run_in_threadpool(
+            s3_helper.save_derived_object,
+            content_hash,
+            self.settings_tag,
+            stored["s3_key"],
+            IMAGE_CONTENT_TYPES[REFERENCE_FORMAT]
+        )
+        stored["original_s3_key"] = original["s3_key"] if original else None
+        return stored
+
+    async def store_uploads(self, files: List[UploadFile], folder: str) -> List[dict]:
+        """
+        store_upload for many files, a few at a time so one batch does not
+        fill the pool's pending limit by itself.
+        """
+        limit = asyncio.Semaphore(self.processor.workers * 2)
+
+        async def store(file: UploadFile) -> dict:
+            async with limit:
+                return await self.store_upload(file, folder)
+
+        return await asyncio.gather(*(store(file) for file in files))
+
+    async def normalize_stored(self, s3_key: str, folder: str) -> str:
+        """
+        Normalize a reference image the client uploaded straight to S3 and
+        return the key to use. The upload itself stays in place as the
+        original, and the result is recorded against its key so the same
+        upload is only normalized once.
+        """
+        if not self.enabled:
+            return s3_key
+
+        normalized_key = await run_in_threadpool(s3_helper.find_derived_object, s3_key, self.settings_tag)
+        if normalized_key is not None:
+            self.reused += 1
+            return normalized_key
+
+        spooled_path = await run_in_threadpool(spool_object, s3_key)
+        try:
+            received = os.path.getsize(spooled_path)
+            REFERENCE_IMAGE_BYTES.labels("received").inc(received)
+            normalized = await self._normalize(spooled_path)
+        finally:
+            os.unlink(spooled_path)
+
+        if normalized is None:
+            self.unchanged += 1
+            REFERENCE_IMAGE_BYTES.labels("stored").inc(received)
+            await run_in_threadpool(s3_helper.save_derived_object, s3_key, self.settings_tag, s3_key)
+            return s3_key
+
+        self.normalized += 1
+        REFERENCE_IMAGE_BYTES.labels("stored").inc(len(normalized))
+        stored = await s3_helper.upload_file_async(
+            bytes_upload(normalized, self._filename(os.path.basename(s3_key)), IMAGE_CONTENT_TYPES[REFERENCE_FORMAT]),
+            folder=folder,
+            metadata={"original-key": s3_key}
+        )
+        await run_in_threadpool(
+            s3_helper.save_derived_object,
+            s3_key,
+            self.settings_tag,
+            stored["s3_key"],
+            IMAGE_CONTENT_TYPES[REFERENCE_FORMAT]
+        )
+        return stored["s3_key"]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_edge": REFERENCE_MAX_EDGE,
+            "format": REFERENCE_FORMAT,
+            "normalized": self.normalized,
+            "unchanged": self.unchanged,
+            "reused": self.reused,
+            "pool": self.processor.stats()
+        }
+
+# Create global instance
+reference_normalizer = ReferenceNormalizer()
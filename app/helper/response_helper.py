@@ -1,6 +1,8 @@
 from fastapi.responses import JSONResponse
 from functools import wraps
+import inspect
 import os
+from app.helper.timing_helper import span
 
 def success_response(message: str, data: dict = None, status_code: int = 200)   :
     response_content = {
@@ -9,7 +11,8 @@ def success_response(message: str, data: dict = None, status_code: int = 200)
         "data": data
     }
 
-    return JSONResponse(status_code=200, content=response_content)
+    with span("serialize"):
+        return JSONResponse(status_code=status_code, content=response_content)
 
 def error_response(message: str, dev_message: str = None, status_code: int = 400):
     environment = os.getenv("ENVIRONMENT", "production")
@@ -21,7 +24,8 @@ def error_response(message: str, dev_message: str = None, status_code: int = 400
     if environment == "development" and dev_message:
         response_content["dev_message"] = dev_message
 
-    return JSONResponse(status_code=status_code, content=response_content)
+    with span("serialize"):
+        return JSONResponse(status_code=status_code, content=response_content)
 
 def safe_api(handler):
     """
@@ -30,6 +34,8 @@ def safe_api(handler):
     @wraps(handler)
     async def wrapper(*args, **kwargs):
         try:
+            if inspect.iscoroutinefunction(handler):
+                return await handler(*args, **kwargs)
             return handler(*args, **kwargs)
         except Exception as e:
             return error_response("Internal Server Error", dev_message=str(e), status_code=500)
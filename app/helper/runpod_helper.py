@@ -1,53 +1,108 @@
-import time, requests
 import os
+import time
+from typing import Optional
+import httpx
 from fastapi import HTTPException
 from dotenv import load_dotenv
+from app.helper.metrics_helper import RUNPOD_SUBMIT_SECONDS
+from app.helper.timing_helper import record_span
 
 load_dotenv()
 
-RUNPOD_URL=f"https://api.runpod.ai/v2/{os.getenv('RUNPOD_ENDPOINT')}/run"
-STATUS_URL=f"https://api.runpod.ai/v2/{os.getenv('RUNPOD_ENDPOINT')}/status"
-
-
-async def submit_job(prompt, image_urls: list = []) :
-   
-    if image_urls is [] or image_urls is None:
-        image_urls = []
-            
-    if isinstance(image_urls, str):
-        image_urls = [image_urls] 
-        
-    elif isinstance(image_urls, list):
-        pass
-    else:
-        raise HTTPException(
-            status_code=400,
-            detail="image_urls must be string or list of strings"
-        )
-
-    payload = {
-        "input": {
-            "prompt": prompt,
-            "image_urls": image_urls
+RUNPOD_BASE_URL = os.getenv("RUNPOD_BASE_URL", "https://api.runpod.ai/v2").rstrip("/")
+RUNPOD_URL=f"{RUNPOD_BASE_URL}/{os.getenv('RUNPOD_ENDPOINT')}/run"
+STATUS_URL=f"{RUNPOD_BASE_URL}/{os.getenv('RUNPOD_ENDPOINT')}/status"
+CANCEL_URL=f"{RUNPOD_BASE_URL}/{os.getenv('RUNPOD_ENDPOINT')}/cancel"
+
+RUNPOD_CONNECT_TIMEOUT = float(os.getenv("RUNPOD_CONNECT_TIMEOUT", "5"))
+RUNPOD_READ_TIMEOUT = float(os.getenv("RUNPOD_READ_TIMEOUT", "30"))
+RUNPOD_JOB_TIMEOUT = float(os.getenv("RUNPOD_JOB_TIMEOUT", "600"))
+RUNPOD_MAX_CONNECTIONS = int(os.getenv("RUNPOD_MAX_CONNECTIONS", "100"))
+# Public URL of our /api/runpod/webhook endpoint; leave empty to rely on polling
+RUNPOD_WEBHOOK_URL = os.getenv("RUNPOD_WEBHOOK_URL", "")
+RUNPOD_WEBHOOK_SECRET = os.getenv("RUNPOD_WEBHOOK_SECRET", "")
+
+
+class RunPodClient:
+    """
+    Async RunPod client sharing one pooled keep-alive HTTP session per process.
+    """
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers={"Authorization": os.getenv("RUNPOD_API_KEY") or ""},
+                timeout=httpx.Timeout(RUNPOD_READ_TIMEOUT, connect=RUNPOD_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=RUNPOD_MAX_CONNECTIONS,
+                    max_keepalive_connections=RUNPOD_MAX_CONNECTIONS
+                )
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def submit_job(self, prompt, image_urls: list = None):
+        if image_urls is None:
+            image_urls = []
+
+        if isinstance(image_urls, str):
+            image_urls = [image_urls]
+        elif isinstance(image_urls, list):
+            pass
+        else:
+            raise HTTPException(
+                status_code=400,
+                detail="image_urls must be string or list of strings"
+            )
+
+        payload = {
+            "input": {
+                "prompt": prompt,
+                "image_urls": image_urls
+            }
         }
-    }
+        if RUNPOD_WEBHOOK_URL:
+            payload["webhook"] = f"{RUNPOD_WEBHOOK_URL}?token={RUNPOD_WEBHOOK_SECRET}"
 
-    res = requests.post(RUNPOD_URL, headers={"Authorization": os.getenv("RUNPOD_API_KEY")} , json = payload).json()
-    return res["id"]
+        started_at = time.perf_counter()
+        outcome = "error"
+        try:
+            res = await self.client.post(RUNPOD_URL, json=payload)
+            res.raise_for_status()
+            job_id = res.json()["id"]
+            outcome = "ok"
+            return job_id
+        finally:
+            elapsed = time.perf_counter() - started_at
+            RUNPOD_SUBMIT_SECONDS.labels(outcome).observe(elapsed)
+            record_span("runpod_submit", elapsed)
 
+    async def check_status(self, job_id):
+        res = await self.client.get(STATUS_URL + "/" + job_id)
+        res.raise_for_status()
+        return res.json()
 
-async def check_status(job_id):
-    return requests.get(STATUS_URL + "/" + job_id, headers={"Authorization": os.getenv("RUNPOD_API_KEY")}).json()
+    async def cancel_job(self, job_id):
+        try:
+            await self.client.post(CANCEL_URL + "/" + job_id)
+        except httpx.HTTPError:
+            pass
+
+# Create global instance
+runpod_client = RunPodClient()
 
 
-async def wait_for_output(job_id):
-    while True:
-        status = await check_status(job_id)
-        state = status["status"]
+async def submit_job(prompt, image_urls: list = None):
+    return await runpod_client.submit_job(prompt, image_urls)
+
+
+async def check_status(job_id):
+    return await runpod_client.check_status(job_id)
 
-        if state == "COMPLETED":
-            return status["output"]
-        elif state == "FAILED":
-            return {"error": "RunPod job failed"}
-        
-        time.sleep(2)
\ No newline at end of file
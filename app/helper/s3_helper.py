@@ -1,9 +1,155 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from sqlalchemy.exc import IntegrityError
+import hashlib
+import hmac
 import os
-from uuid import uuid4
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit, parse_qs
+from typing import List, Optional
 from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
 import io
+from uuid import uuid4
+from dotenv import load_dotenv
+from app.database import SessionLocal
+from app.models import StoredObject, DerivedObject
+from app.helper.cache_helper import TTLCache
+from app.helper.metrics_helper import S3_UPLOAD_SECONDS, S3_UPLOAD_BYTES
+from app.helper.timing_helper import record_span
+
+load_dotenv()
+
+S3_MAX_UPLOAD_SIZE = int(os.getenv("S3_MAX_UPLOAD_SIZE", str(50 * 1024 * 1024)))
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+S3_MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "4"))
+HASH_CHUNK_SIZE = 1024 * 1024
+# S3-compatible endpoint (e.g. MinIO or benchmarks/fake_s3.py); AWS when empty
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "").rstrip("/")
+# Direct-to-S3 uploads of reference images
+S3_UPLOAD_URL_EXPIRES = int(os.getenv("S3_UPLOAD_URL_EXPIRES", "900"))
+UPLOAD_ALLOWED_CONTENT_TYPES = [
+    content_type.strip()
+    for content_type in os.getenv("UPLOAD_ALLOWED_CONTENT_TYPES", "image/png,image/jpeg,image/webp").split(",")
+    if content_type.strip()
+]
+UPLOAD_EXTENSIONS = {"image/png": "png", "image/jpeg": "jpg", "image/webp": "webp"}
+DIRECT_UPLOAD_FOLDER = "image-generation/uploads"
+# Presigned GET URLs returned for outputs and reference images
+S3_DOWNLOAD_URL_EXPIRES = int(os.getenv("S3_DOWNLOAD_URL_EXPIRES", "3600"))
+# Cached URLs are replaced this many seconds before they expire
+S3_DOWNLOAD_URL_MIN_VALIDITY = int(os.getenv("S3_DOWNLOAD_URL_MIN_VALIDITY", "300"))
+S3_DOWNLOAD_URL_CACHE_SIZE = int(os.getenv("S3_DOWNLOAD_URL_CACHE_SIZE", "100000"))
+
+
+class FileTooLargeError(Exception):
+    pass
+
+
+class InvalidUploadError(Exception):
+    pass
+
+
+class LimitedReader:
+    """
+    File-like wrapper that fails once more than max_size bytes have been read.
+    """
+    def __init__(self, fileobj, max_size: int):
+        self.fileobj = fileobj
+        self.max_size = max_size
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.fileobj.read(size)
+        self.bytes_read += len(chunk)
+        if self.bytes_read > self.max_size:
+            raise FileTooLargeError(f"File exceeds the maximum upload size of {self.max_size} bytes")
+        return chunk
+
+
+class DownloadUrlSigner:
+    """
+    Signs GET URLs with SigV4 query authentication, locally and without
+    botocore's per-call request pipeline (~0.5ms per URL). The URL layout
+    (scheme, host, path-style or virtual-host, region) is taken from one
+    URL presigned by boto3, and the signing key is derived once per day,
+    so each URL costs two HMACs and a hash. If boto3 does not presign
+    with SigV4 for this client, every URL is signed by boto3 instead.
+    """
+    def __init__(self, s3_client, bucket_name: str):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self._layout = None
+        self._signing_key = None
+
+    def _probe(self):
+        probe_key = "presign-probe"
+        url = self.s3_client.generate_presigned_url(
+            "get_object", Params={"Bucket": self.bucket_name, "Key": probe_key}, ExpiresIn=60
+        )
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        if query.get("X-Amz-Algorithm") != ["AWS4-HMAC-SHA256"] or not parts.path.endswith(probe_key):
+            return False
+        region = query["X-Amz-Credential"][0].split("/")[2]
+        return {
+            "base": f"{parts.scheme}://{parts.netloc}",
+            "host": parts.netloc,
+            "path_prefix": parts.path[:-len(probe_key)],
+            "region": region
+        }
+
+    def _key_for(self, date_stamp: str, secret_key: str) -> bytes:
+        if self._signing_key is None or self._signing_key[:2] != (date_stamp, secret_key):
+            key = f"AWS4{secret_key}".encode("utf-8")
+            for part in (date_stamp, self._layout["region"], "s3", "aws4_request"):
+                key = hmac.new(key, part.encode("utf-8"), hashlib.sha256).digest()
+            self._signing_key = (date_stamp, secret_key, key)
+        return self._signing_key[2]
+
+    def sign(self, s3_key: str, expires_in: int) -> str:
+        if self._layout is None:
+            self._layout = self._probe()
+        credentials = getattr(getattr(self.s3_client, "_request_signer", None), "_credentials", None)
+        if not self._layout or credentials is None:
+            return self.s3_client.generate_presigned_url(
+                "get_object", Params={"Bucket": self.bucket_name, "Key": s3_key}, ExpiresIn=expires_in
+            )
+
+        credentials = credentials.get_frozen_credentials()
+        now = datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date_stamp = amz_date[:8]
+        scope = f"{date_stamp}/{self._layout['region']}/s3/aws4_request"
+
+        path = self._layout["path_prefix"] + quote(s3_key, safe="/~")
+        params = [
+            ("X-Amz-Algorithm", "AWS4-HMAC-SHA256"),
+            ("X-Amz-Credential", f"{credentials.access_key}/{scope}"),
+            ("X-Amz-Date", amz_date),
+            ("X-Amz-Expires", str(expires_in)),
+            ("X-Amz-SignedHeaders", "host")
+        ]
+        if credentials.token:
+            params.append(("X-Amz-Security-Token", credentials.token))
+        query = "&".join(f"{name}={quote(value, safe='-_.~')}" for name, value in sorted(params))
+
+        canonical_request = f"GET\n{path}\n{query}\nhost:{self._layout['host']}\n\nhost\nUNSIGNED-PAYLOAD"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode("utf-8")).hexdigest()
+        ])
+        signature = hmac.new(
+            self._key_for(date_stamp, credentials.secret_key), string_to_sign.encode("utf-8"), hashlib.sha256
+        ).hexdigest()
+        return f"{self._layout['base']}{path}?{query}&X-Amz-Signature={signature}"
+
 
 class S3Helper:
     def __init__(self):
@@ -11,43 +157,294 @@ class S3Helper:
             's3',
             aws_access_key_id = os.getenv('API_KEY'),
             aws_secret_access_key = os.getenv('API_SECRET'),
-            region_name = os.getenv('AWS_REGION')
+            region_name = os.getenv('AWS_REGION'),
+            endpoint_url = S3_ENDPOINT_URL or None,
+            # SigV4 everywhere, so presigned URLs can be signed by DownloadUrlSigner.
+            # Custom endpoints rarely resolve bucket subdomains
+            config = Config(
+                signature_version="s3v4",
+                s3={"addressing_style": "path" if S3_ENDPOINT_URL else "auto"}
+            )
         )
         self.bucket_name = os.getenv('BUCKET_NAME')
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MAX_CONCURRENCY
+        )
+        self.url_signer = DownloadUrlSigner(self.s3_client, self.bucket_name)
+        # URLs are reused until S3_DOWNLOAD_URL_MIN_VALIDITY seconds before they expire
+        self.download_urls = TTLCache(
+            max_size=S3_DOWNLOAD_URL_CACHE_SIZE,
+            ttl=max(S3_DOWNLOAD_URL_EXPIRES - S3_DOWNLOAD_URL_MIN_VALIDITY, 0)
+        )
+
+    def object_url(self, s3_key: str) -> str:
+        if S3_ENDPOINT_URL:
+            return f"{S3_ENDPOINT_URL}/{self.bucket_name}/{s3_key}"
+        return f"https://{self.bucket_name}.s3.amazonaws.com/{s3_key}"
 
-    def upload_file(self, file: UploadFile, folder: str = "uploads") -> dict:
+    def key_for(self, path: Optional[str]) -> Optional[str]:
         """
-        Upload a file to S3 and return the URL
+        S3 key of a stored path, which is either a key or one of our object
+        URLs; None for empty paths and URLs outside the bucket.
         """
+        if not path:
+            return None
+        if path.startswith(("http://", "https://")):
+            bucket_url = self.object_url("")
+            return path[len(bucket_url):] if path.startswith(bucket_url) else None
+        return path
+
+    def download_url(self, path: Optional[str]) -> Optional[str]:
+        """
+        Presigned GET URL for a stored output or reference image. Accepts
+        an S3 key or one of our object URLs; other URLs are returned as is.
+        """
+        s3_key = self.key_for(path)
+        if s3_key is None:
+            return path
+
+        url = self.download_urls.get(s3_key)
+        if url is None:
+            url = self.url_signer.sign(s3_key, S3_DOWNLOAD_URL_EXPIRES)
+            self.download_urls.set(s3_key, url)
+        return url
+
+    def download_urls_for(self, paths: Optional[List[str]]) -> List[Optional[str]]:
+        return [self.download_url(path) for path in paths or []]
+
+    def hash_file(self, fileobj) -> str:
+        """
+        SHA-256 of a file read in chunks, enforcing the max upload size
+        """
+        digest = hashlib.sha256()
+        reader = LimitedReader(fileobj, S3_MAX_UPLOAD_SIZE)
+        while True:
+            chunk = reader.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def find_stored_object(self, content_hash: str):
+        db = SessionLocal()
+        try:
+            stored = db.query(StoredObject).filter(StoredObject.content_hash == content_hash).first()
+            return stored.s3_key if stored else None
+        finally:
+            db.close()
+
+    def save_stored_object(self, content_hash: str, s3_key: str, content_type: str = None):
+        db = SessionLocal()
+        try:
+            db.add(StoredObject(content_hash=content_hash, s3_key=s3_key, content_type=content_type))
+            db.commit()
+        except IntegrityError:
+            # Another upload of the same content won the race
+            db.rollback()
+        finally:
+            db.close()
+
+    def find_derived_object(self, source: str, kind: str):
+        """
+        Key of the object made from source (a content hash or S3 key) as kind, if any
+        """
+        db = SessionLocal()
+        try:
+            derived = db.get(DerivedObject, (source, kind))
+            return derived.s3_key if derived else None
+        finally:
+            db.close()
+
+    def save_derived_object(self, source: str, kind: str, s3_key: str, content_type: str = None):
+        db = SessionLocal()
         try:
-            # Generate unique filename
+            db.add(DerivedObject(source=source, kind=kind, s3_key=s3_key, content_type=content_type))
+            db.commit()
+        except IntegrityError:
+            # Made concurrently by another request
+            db.rollback()
+        finally:
+            db.close()
+
+    def upload_file(self, file: UploadFile, folder: str = "uploads", metadata: dict = None) -> dict:
+        """
+        Stream a file to S3 and return the URL. Files above the multipart
+        threshold are sent as concurrent parts, so memory use is bounded by
+        the chunk size rather than the file size. Objects are keyed by their
+        content hash and content that was uploaded before is not sent again.
+        metadata is stored as x-amz-meta-* on newly uploaded objects.
+        """
+        started_at = time.perf_counter()
+        try:
+            if file.size is not None and file.size > S3_MAX_UPLOAD_SIZE:
+                raise FileTooLargeError(f"File exceeds the maximum upload size of {S3_MAX_UPLOAD_SIZE} bytes")
+
+            # Hash the content in chunks; identical bytes map to the same key
+            content_hash = self.hash_file(file.file)
+            size = file.file.tell()
             file_extension = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-            unique_filename = f"{uuid4()}.{file_extension}"
-            s3_key = f"{folder}/{unique_filename}"
-            
-            # Read file content
-            file_content = file.file.read()
-            
-            # Upload to S3
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=s3_key,
-                Body=file_content,
-                ContentType=file.content_type
-            )
+            s3_key = self.find_stored_object(content_hash)
+            deduplicated = s3_key is not None
+
+            if not deduplicated:
+                s3_key = f"{folder}/{content_hash}.{file_extension}"
+                file.file.seek(0)
 
-            file_url = f"https://{self.bucket_name}.s3.amazonaws.com/{s3_key}"
+                # Upload to S3, reading the file in chunks
+                self.s3_client.upload_fileobj(
+                    LimitedReader(file.file, S3_MAX_UPLOAD_SIZE),
+                    self.bucket_name,
+                    s3_key,
+                    ExtraArgs={
+                        "ContentType": file.content_type or "application/octet-stream",
+                        **({"Metadata": metadata} if metadata else {})
+                    },
+                    Config=self.transfer_config
+                )
+                self.save_stored_object(content_hash, s3_key, file.content_type)
+
+            file_url = self.object_url(s3_key)
+            S3_UPLOAD_SECONDS.labels(str(deduplicated).lower()).observe(time.perf_counter() - started_at)
+            S3_UPLOAD_BYTES.labels(str(deduplicated).lower()).observe(size)
             
             return {
                 "s3_key": s3_key,
-                "url": file_url
+                "url": file_url,
+                "content_hash": content_hash,
+                "deduplicated": deduplicated
             }
 
             
         except ClientError as e:
             raise Exception(f"S3 upload failed: {str(e)}")
         finally:
+            record_span("s3", time.perf_counter() - started_at)
             file.file.close()
+
+    def get_bytes(self, s3_key: str) -> bytes:
+        """
+        Read a whole object, refusing objects above the max upload size
+        """
+        started_at = time.perf_counter()
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+            if response["ContentLength"] > S3_MAX_UPLOAD_SIZE:
+                response["Body"].close()
+                raise FileTooLargeError(f"File exceeds the maximum upload size of {S3_MAX_UPLOAD_SIZE} bytes")
+            return response["Body"].read()
+        except ClientError as e:
+            raise Exception(f"S3 download failed: {str(e)}")
+        finally:
+            record_span("s3", time.perf_counter() - started_at)
+
+    def download_to_file(self, s3_key: str, fileobj) -> int:
+        """
+        Copy an object into fileobj in chunks and return its size, refusing
+        objects above the max upload size
+        """
+        started_at = time.perf_counter()
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+            if response["ContentLength"] > S3_MAX_UPLOAD_SIZE:
+                response["Body"].close()
+                raise FileTooLargeError(f"File exceeds the maximum upload size of {S3_MAX_UPLOAD_SIZE} bytes")
+            for chunk in response["Body"].iter_chunks(HASH_CHUNK_SIZE):
+                fileobj.write(chunk)
+            return response["ContentLength"]
+        except ClientError as e:
+            raise Exception(f"S3 download failed: {str(e)}")
+        finally:
+            record_span("s3", time.perf_counter() - started_at)
+
+    def put_bytes(self, s3_key: str, data: bytes, content_type: str, cache_control: str = None):
+        started_at = time.perf_counter()
+        try:
+            extra = {"CacheControl": cache_control} if cache_control else {}
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=s3_key, Body=data, ContentType=content_type, **extra)
+        except ClientError as e:
+            raise Exception(f"S3 upload failed: {str(e)}")
+        finally:
+            record_span("s3", time.perf_counter() - started_at)
+
+    def user_upload_prefix(self, user_id: int) -> str:
+        return f"{DIRECT_UPLOAD_FOLDER}/{user_id}/"
+
+    def create_presigned_upload(self, user_id: int, content_type: str, size: int = None) -> dict:
+        """
+        Presigned POST, and PUT when size is given, for a client to upload
+        one reference image straight to S3. Signing is local; no request is
+        made to S3. The POST policy enforces the content type and max size;
+        the PUT signs the content type and the exact size, since a PUT URL
+        cannot carry a size range.
+        """
+        if content_type not in UPLOAD_ALLOWED_CONTENT_TYPES:
+            raise InvalidUploadError(f"Content type must be one of: {', '.join(UPLOAD_ALLOWED_CONTENT_TYPES)}")
+        if size is not None and size > S3_MAX_UPLOAD_SIZE:
+            raise FileTooLargeError(f"File exceeds the maximum upload size of {S3_MAX_UPLOAD_SIZE} bytes")
+
+        extension = UPLOAD_EXTENSIONS.get(content_type, content_type.split("/")[-1])
+        s3_key = f"{self.user_upload_prefix(user_id)}{uuid4().hex}.{extension}"
+
+        put = None
+        if size is not None:
+            put = {
+                "url": self.s3_client.generate_presigned_url(
+                    "put_object",
+                    Params={"Bucket": self.bucket_name, "Key": s3_key, "ContentType": content_type, "ContentLength": size},
+                    ExpiresIn=S3_UPLOAD_URL_EXPIRES
+                ),
+                "headers": {"Content-Type": content_type, "Content-Length": str(size)}
+            }
+
+        post = self.s3_client.generate_presigned_post(
+            Bucket=self.bucket_name,
+            Key=s3_key,
+            Fields={"Content-Type": content_type},
+            Conditions=[
+                {"Content-Type": content_type},
+                ["content-length-range", 1, S3_MAX_UPLOAD_SIZE]
+            ],
+            ExpiresIn=S3_UPLOAD_URL_EXPIRES
+        )
+
+        return {
+            "s3_key": s3_key,
+            "expires_in": S3_UPLOAD_URL_EXPIRES,
+            "max_size": S3_MAX_UPLOAD_SIZE,
+            "put": put,
+            "post": post
+        }
+
+    def verify_upload(self, s3_key: str, user_id: int, any_user: bool = False) -> str:
+        """
+        Check that a directly uploaded reference image exists, belongs to the
+        user (any user's upload when any_user) and is within the limits.
+        """
+        prefix = f"{DIRECT_UPLOAD_FOLDER}/" if any_user else self.user_upload_prefix(user_id)
+        if not s3_key.startswith(prefix) or ".." in s3_key:
+            raise InvalidUploadError("Reference image key is not one of your uploads")
+
+        try:
+            head = self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+        except ClientError:
+            raise InvalidUploadError("Reference image has not been uploaded")
+
+        if head["ContentLength"] > S3_MAX_UPLOAD_SIZE:
+            raise FileTooLargeError(f"File exceeds the maximum upload size of {S3_MAX_UPLOAD_SIZE} bytes")
+        if head.get("ContentType") not in UPLOAD_ALLOWED_CONTENT_TYPES:
+            raise InvalidUploadError(f"Content type must be one of: {', '.join(UPLOAD_ALLOWED_CONTENT_TYPES)}")
+        return s3_key
+
+    async def verify_upload_async(self, s3_key: str, user_id: int, any_user: bool = False) -> str:
+        return await run_in_threadpool(self.verify_upload, s3_key, user_id, any_user)
+
+    async def upload_file_async(self, file: UploadFile, folder: str = "uploads", metadata: dict = None) -> dict:
+        """
+        Run upload_file in the threadpool so the event loop is not blocked
+        """
+        return await run_in_threadpool(self.upload_file, file, folder, metadata)
     
     # def delete_file(self, file_url: str) -> bool:
     #     """
@@ -66,27 +463,6 @@ class S3Helper:
     #     except ClientError as e:
     #         print(f"Failed to delete file from S3: {str(e)}")
     #         return False
-    
-    # def generate_presigned_url(self, file_url: str, expires_in: int = 3600) -> str:
-    #     """
-    #     Generate a pre-signed URL for temporary access
-    #     """
-    #     try:
-    #         # Extract key from URL
-    #         key = file_url.replace(f"https://{self.bucket_name}.s3.amazonaws.com/", "")
-            
-    #         url = self.s3_client.generate_presigned_url(
-    #             'get_object',
-    #             Params={
-    #                 'Bucket': self.bucket_name,
-    #                 'Key': key
-    #             },
-    #             ExpiresIn=expires_in
-    #         )
-    #         return url
-            
-    #     except ClientError as e:
-    #         raise Exception(f"Failed to generate presigned URL: {str(e)}")
 
 # Create global instance
 s3_helper = S3Helper()
\ No newline at end of file
@@ -0,0 +1,103 @@
+import itertools
+import os
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Optional
+from dotenv import load_dotenv
+
+from app.enums.priority_class import PriorityClass
+from app.enums.user_type import UserType
+
+load_dotenv()
+
+# Seconds of waiting that promote a job by one priority class
+SCHEDULER_AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", "30"))
+
+
+def priority_class_for(user_type: int, interactive: bool = True) -> PriorityClass:
+    admin = user_type in [UserType.SUPERADMIN, UserType.ADMIN]
+    if interactive:
+        return PriorityClass.ADMIN_INTERACTIVE if admin else PriorityClass.USER_INTERACTIVE
+    return PriorityClass.ADMIN_BATCH if admin else PriorityClass.USER_BATCH
+
+
+def default_class_caps(workers: int) -> Dict[PriorityClass, int]:
+    """
+    Share of the workers each class may occupy, overridable per class with
+    SCHEDULER_CAP_<CLASS>, e.g. SCHEDULER_CAP_USER_BATCH=2.
+    """
+    defaults = {
+        PriorityClass.ADMIN_INTERACTIVE: workers,
+        PriorityClass.USER_INTERACTIVE: max(1, workers * 3 // 4),
+        PriorityClass.ADMIN_BATCH: max(1, workers // 2),
+        PriorityClass.USER_BATCH: max(1, workers // 2)
+    }
+    return {
+        priority_class: int(os.getenv(f"SCHEDULER_CAP_{priority_class.name}") or cap)
+        for priority_class, cap in defaults.items()
+    }
+
+
+@dataclass
+class ScheduledItem:
+    item: Any
+    priority_class: PriorityClass
+    # Jobs sharing a group (a batch) are limited together
+    group: Optional[int] = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+    sequence: int = 0
+
+    def sort_key(self, aging: float) -> tuple:
+        # class - waited / aging, minus the now term every item shares
+        return (self.priority_class + self.enqueued_at / aging, self.sequence)
+
+
+class PriorityScheduler:
+    """
+    Pending work ordered by priority class with linear aging: an item that
+    has waited aging seconds ranks with fresh items one class above it.
+    Items are kept in one FIFO per class, so the next item is always the
+    best-ranked head among classes the caller allows to run.
+    """
+    def __init__(self, aging: float = SCHEDULER_AGING_SECONDS):
+        self.aging = aging
+        self._queues: Dict[PriorityClass, Deque[ScheduledItem]] = {
+            priority_class: deque() for priority_class in PriorityClass
+        }
+        self._sequence = itertools.count()
+
+    def push(self, item: Any, priority_class: PriorityClass, group: Optional[int] = None) -> ScheduledItem:
+        scheduled = ScheduledItem(item=item, priority_class=priority_class, group=group, sequence=next(self._sequence))
+        self._queues[priority_class].append(scheduled)
+        return scheduled
+
+    def pop_next(self, can_run: Callable[[ScheduledItem], bool]) -> Optional[ScheduledItem]:
+        best = None
+        best_queue = None
+        for queue in self._queues.values():
+            # The first runnable item of a class; later ones in a saturated
+            # group are skipped without losing their place
+            candidate = next((scheduled for scheduled in queue if can_run(scheduled)), None)
+            if candidate is None:
+                continue
+            if best is None or candidate.sort_key(self.aging) < best.sort_key(self.aging):
+                best, best_queue = candidate, queue
+        if best is not None:
+            best_queue.remove(best)
+        return best
+
+    def drain(self) -> list:
+        items = [scheduled for queue in self._queues.values() for scheduled in queue]
+        for queue in self._queues.values():
+            queue.clear()
+        return items
+
+    def size(self, priority_class: Optional[PriorityClass] = None) -> int:
+        if priority_class is not None:
+            return len(self._queues[priority_class])
+        return sum(len(queue) for queue in self._queues.values())
+
+    def oldest_wait(self, priority_class: PriorityClass) -> float:
+        queue = self._queues[priority_class]
+        return time.monotonic() - queue[0].enqueued_at if queue else 0
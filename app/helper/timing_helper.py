@@ -0,0 +1,70 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SLOW_REQUEST_THRESHOLD_SECONDS = float(os.getenv("SLOW_REQUEST_THRESHOLD_SECONDS", "5"))
+SLOW_JOB_THRESHOLD_SECONDS = float(os.getenv("SLOW_JOB_THRESHOLD_SECONDS", "120"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RequestTiming:
+    """
+    Time spent per stage (auth, db, s3, runpod_submit, runpod_wait,
+    serialize, ...) while serving one request or running one job.
+    """
+    started_at: float = field(default_factory=time.perf_counter)
+    spans: Dict[str, float] = field(default_factory=dict)
+    counts: Dict[str, int] = field(default_factory=dict)
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def breakdown(self) -> str:
+        return " ".join(
+            f"{name}={seconds * 1000:.1f}ms" + (f"(x{self.counts[name]})" if self.counts[name] > 1 else "")
+            for name, seconds in self.spans.items()
+        )
+
+    def server_timing(self) -> str:
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.spans.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+# Timing of the request or job being served; a mutable object, so copies of
+# the context made by the threadpool and SQLAlchemy's greenlets share it
+current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("current_timing", default=None)
+
+
+def record_span(name: str, seconds: float):
+    timing = current_timing.get()
+    if timing is not None:
+        timing.add(name, seconds)
+
+
+@contextmanager
+def span(name: str):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started_at)
+
+
+def log_if_slow(label: str, timing: RequestTiming, threshold: float):
+    elapsed = timing.elapsed()
+    if elapsed >= threshold:
+        logger.warning("Slow %s: %.2fs %s", label, elapsed, timing.breakdown())
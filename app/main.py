@@ -1,9 +1,19 @@
 from fastapi import FastAPI
-from app.database import Base, engine
+from app.database import Base, engine, async_engine
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 # from app.middleware.auth_middleware import AuthMiddleware
-from app.routes import auth, generation
+from app.routes import auth, generation, webhook, system, metrics
+from app.middleware.metrics_middleware import MetricsMiddleware
+from app.middleware.timing_middleware import TimingMiddleware
+from app.helper.job_helper import generation_pool
+from app.helper.runpod_helper import runpod_client
+from app.helper.poller_helper import runpod_poller
+from app.helper.password_helper import password_hasher
+from app.helper.derivative_helper import derivative_pipeline
+from app.helper.image_helper import image_processor
+from app.helper.reference_helper import reference_normalizer
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
 
@@ -12,7 +22,23 @@ load_dotenv(override=True)
 # Create tables
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Image Generation System")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start background generation workers
+    await generation_pool.start()
+    await derivative_pipeline.start()
+    await generation_pool.recover()
+    yield
+    await generation_pool.stop()
+    await derivative_pipeline.stop()
+    await runpod_poller.stop()
+    await runpod_client.close()
+    await async_engine.dispose()
+    password_hasher.shutdown()
+    image_processor.shutdown()
+    reference_normalizer.shutdown()
+
+app = FastAPI(title="Image Generation System", lifespan=lifespan)
 
 # Include routes
 app.include_router(auth.router, prefix="/api")
@@ -26,6 +52,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 app.include_router(generation.router,prefix="/api")
+app.include_router(webhook.router, prefix="/api")
+app.include_router(system.router, prefix="/api")
+app.include_router(metrics.router)
+app.add_middleware(MetricsMiddleware)
+# Added last so it wraps MetricsMiddleware and sets up the request's timing first
+app.add_middleware(TimingMiddleware)
 
 @app.get("/")
 def root():
@@ -0,0 +1,49 @@
+import time
+from app.helper.metrics_helper import (
+    HTTP_REQUEST_SECONDS,
+    HTTP_REQUESTS_IN_FLIGHT,
+    HTTP_REQUEST_DB_QUERIES,
+    HTTP_REQUEST_DB_SECONDS
+)
+from app.helper.timing_helper import current_timing
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status and DB usage of every HTTP request, labelled by
+    route template (e.g. /api/generate/status/{session_id}) to keep label
+    cardinality bounded. DB usage comes from the request's RequestTiming,
+    set up by TimingMiddleware.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route_path, str(status_code)).observe(elapsed)
+
+            timing = current_timing.get()
+            if timing is not None:
+                HTTP_REQUEST_DB_QUERIES.labels(route_path).observe(timing.counts.get("db", 0))
+                HTTP_REQUEST_DB_SECONDS.labels(route_path).observe(timing.spans.get("db", 0.0))
@@ -0,0 +1,82 @@
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+from dotenv import load_dotenv
+from app.helper.timing_helper import RequestTiming, current_timing, log_if_slow, SLOW_REQUEST_THRESHOLD_SECONDS
+
+load_dotenv()
+
+# Fraction of requests to profile with cProfile; 0 disables profiling
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+logger = logging.getLogger(__name__)
+
+
+class TimingMiddleware:
+    """
+    Tracks a per-request RequestTiming, returns it in a Server-Timing header
+    and logs requests slower than SLOW_REQUEST_THRESHOLD_SECONDS with their
+    breakdown. Streamed responses (SSE, exports) are not logged: they are
+    meant to stay open, so their duration says nothing about slowness.
+    With PROFILE_SAMPLE_RATE set, a sample of requests is run under
+    cProfile and the stats are written to PROFILE_DIR as .prof files
+    (open with pstats or snakeviz). Only one request is profiled at a time,
+    and the profile also sees other work on the event loop meanwhile.
+    """
+    def __init__(self, app, sample_rate: float = PROFILE_SAMPLE_RATE, profile_dir: str = PROFILE_DIR):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.profile_dir = profile_dir
+        self._profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        streaming = False
+
+        async def send_wrapper(message):
+            nonlocal streaming
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"server-timing", timing.server_timing().encode("latin-1"))
+                ]
+            elif message["type"] == "http.response.body" and message.get("more_body"):
+                # Body sent in several parts: a streamed response
+                streaming = True
+            await send(message)
+
+        profiler = None
+        if self.sample_rate > 0 and not self._profiling and random.random() < self.sample_rate:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_timing.reset(token)
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                self._save_profile(profiler, scope, timing)
+            if not streaming:
+                log_if_slow(f"request {scope['method']} {scope['path']}", timing, SLOW_REQUEST_THRESHOLD_SECONDS)
+
+    def _save_profile(self, profiler: cProfile.Profile, scope, timing: RequestTiming):
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            name = re.sub(r"[^A-Za-z0-9_-]+", "_", route).strip("_") or "root"
+            filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method']}-{name}-{timing.elapsed() * 1000:.0f}ms.prof"
+            profiler.dump_stats(os.path.join(self.profile_dir, filename))
+        except Exception:
+            logger.exception("Failed to save request profile")
@@ -1,8 +1,17 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Index
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from app.database import Base
 from app.enums.user_type import UserType
+from app.enums.generation_status import GenerationStatus
+
+# SQLite's CURRENT_TIMESTAMP has second precision; bind values in the same
+# format so keyset comparisons on created_at match what is stored
+KeysetDateTime = DateTime(timezone=True).with_variant(
+    sqlite.DATETIME(storage_format="%(year)04d-%(month)02d-%(day)02d %(hour)02d:%(minute)02d:%(second)02d"),
+    "sqlite"
+)
 
 class User(Base):
     __tablename__ = "users"
@@ -29,20 +38,68 @@ class GenerationSession(Base):
     output_path = Column(String, nullable=True)
     approved = Column(Boolean, default=False)
     attempts = Column(Integer, default=1)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    status = Column(String, nullable=False, default=GenerationStatus.PENDING.value)  # pending, running, completed, failed
+    job_id = Column(String, nullable=True)  # RunPod job id of the latest attempt
+    error_message = Column(Text, nullable=True)
+    batch_id = Column(Integer, ForeignKey("generation_batches.batch_id"), nullable=True, index=True)
+    # Downscaled copies of output_path, filled in by the derivative pipeline
+    thumbnail_key = Column(String, nullable=True)
+    preview_key = Column(String, nullable=True)
+    created_at = Column(KeysetDateTime, server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), default=func.now())
     
     user = relationship("User", back_populates="sessions")
 
+    __table_args__ = (
+        # Keyset pagination on (created_at, session_id), overall and per user
+        Index("ix_generation_sessions_created_session", "created_at", "session_id"),
+        Index("ix_generation_sessions_user_created_session", "user_id", "created_at", "session_id"),
+    )
+
+class GenerationBatch(Base):
+    __tablename__ = "generation_batches"
+
+    batch_id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.user_id"))
+    total_items = Column(Integer, nullable=False)
+    parallelism = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class GenerationAttempt(Base):
     __tablename__ = "generation_attempts"
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("generation_sessions.session_id"))
+    session_id = Column(Integer, ForeignKey("generation_sessions.session_id"), index=True)
     prompt = Column(Text)
     reference_image = Column(Text)
     reference_images = Column(Text)
     output_path = Column(Text)
+    thumbnail_key = Column(String, nullable=True)
+    preview_key = Column(String, nullable=True)
     attempt_number = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), default=func.now())
+
+class StoredObject(Base):
+    __tablename__ = "stored_objects"
+
+    content_hash = Column(String, primary_key=True)  # sha256 of the uploaded bytes
+    s3_key = Column(String, nullable=False)
+    content_type = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class DerivedObject(Base):
+    __tablename__ = "derived_objects"
+
+    source = Column(String, primary_key=True)  # content hash or S3 key of the object it was made from
+    kind = Column(String, primary_key=True)  # what was made and with which settings, e.g. derivatives-256-1024-webp-q80
+    s3_key = Column(String, nullable=False)
+    content_type = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class GenerationCacheEntry(Base):
+    __tablename__ = "generation_cache"
+
+    cache_key = Column(String, primary_key=True)  # sha256 of normalized prompt + reference set
+    image_key = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
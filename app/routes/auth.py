@@ -1,5 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from datetime import datetime
 from app.schemas import RefreshRequest
 from jose import jwt, JWTError
 from app.deps import REFRESH_SECRET_KEY ,verify_token
@@ -7,26 +12,40 @@ from app.schemas import UserCreate, UserLogin, Token
 from app.models import User, GenerationSession
 from app.helper.response_helper import success_response, error_response, safe_api
 from app.enums.user_type import UserType
-from app.deps import get_db, get_password_hash, verify_password, create_access_token, create_refresh_token, require_role
+from app.helper.pagination_helper import paginate_sessions, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.helper.s3_helper import s3_helper
+from app.helper.export_helper import iter_activity_rows, iter_ndjson, iter_csv
+from app.helper.password_helper import password_hasher, PasswordPoolBusyError, PASSWORD_POOL_RETRY_AFTER
+from app.deps import get_db, get_async_db, get_password_hash_async, verify_password_async, create_access_token, create_refresh_token, require_role
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+def password_pool_busy_response(e: PasswordPoolBusyError):
+    response = error_response(str(e), status_code=503)
+    response.headers["Retry-After"] = str(PASSWORD_POOL_RETRY_AFTER)
+    return response
+
 @router.post("/register", response_model=dict)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user.email).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    existing = (await db.execute(select(User).where(User.email == user.email))).scalars().first()
     if existing:
        return error_response("Email already exists", 400)
+
+    try:
+        hashed_password = await get_password_hash_async(user.password)
+    except PasswordPoolBusyError as e:
+        return password_pool_busy_response(e)
     
     new_user = User(
         firstname=user.firstname,
         lastname=user.lastname,
         email=user.email,
-        password=get_password_hash(user.password),
+        password=hashed_password,
         user_type=user.user_type.value
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return success_response(
         "User registered successfully",
         {"user_id": new_user.user_id, "email": new_user.email,"user_type": UserType(new_user.user_type).name},
@@ -35,10 +54,19 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
 
 @router.post("/login", response_model=Token)
 @safe_api
-def login(payload: UserLogin, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == payload.email).first()
-    if not user or not verify_password(payload.password, user.password):
-        return error_response("Invalid email or password", 401)
+async def login(payload: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = (await db.execute(select(User).where(User.email == payload.email))).scalars().first()
+    try:
+        if not user or not await verify_password_async(payload.password, user.password):
+            return error_response("Invalid email or password", 401)
+
+        # Upgrade hashes made with an older cost factor while we have the plain password
+        if password_hasher.needs_rehash(user.password):
+            user.password = await get_password_hash_async(payload.password)
+            await db.commit()
+            await db.refresh(user)
+    except PasswordPoolBusyError as e:
+        return password_pool_busy_response(e)
     
     access_token = create_access_token(user.user_id)
     refresh_token = create_refresh_token(user.user_id)
@@ -89,22 +117,43 @@ def refresh_token(payload: RefreshRequest, db: Session = Depends(get_db)):
 
 @router.get("/all-activities")
 def get_all_activities(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: Optional[int] = None,
+    approved: Optional[bool] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
     current_user: User = Depends(require_role(UserType.ADMIN, UserType.SUPERADMIN)),
     db: Session = Depends(get_db)
 ):
-    # Admin can see all generation sessions from all users
-    sessions = db.query(GenerationSession).join(User).all()
+    # Admin can see all generation sessions from all users, one page at a time
+    try:
+        rows, next_cursor = paginate_sessions(
+            db,
+            cursor=cursor,
+            limit=limit,
+            user_id=user_id,
+            approved=approved,
+            date_from=date_from,
+            date_to=date_to
+        )
+    except ValueError as e:
+        return error_response(str(e), status_code=400)
     
     session_data = []
-    for session in sessions:
+    for session, user in rows:
         session_data.append({
             "session_id": session.session_id,
             "user_id": session.user_id,
-            "user_email": current_user.email,
-            "user_name": f"{current_user.firstname} {current_user.lastname}",
+            "user_email": user.email,
+            "user_name": f"{user.firstname} {user.lastname}",
             "reference_image": session.reference_image,
+            "reference_image_url": s3_helper.download_url(session.reference_image),
             "input_prompt": session.input_prompt,
             "output_path": session.output_path,
+            "output_url": s3_helper.download_url(session.output_path),
+            "thumbnail_url": s3_helper.download_url(session.thumbnail_key),
+            "preview_url": s3_helper.download_url(session.preview_key),
             "approved": session.approved,
             "attempts": session.attempts,
             "created_at": session.created_at.isoformat() if session.created_at else None
@@ -112,7 +161,31 @@ def get_all_activities(
     
     return success_response(
         "All user activities retrieved",
-        {"sessions": session_data, "total_sessions": len(session_data)}
+        {"sessions": session_data, "total_sessions": len(session_data), "next_cursor": next_cursor}
+    )
+
+@router.get("/export-activities")
+def export_activities(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    user_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    current_user: User = Depends(require_role(UserType.ADMIN, UserType.SUPERADMIN))
+):
+    """
+    Stream generation history (one row per attempt) as NDJSON or CSV.
+    Rows are written as they are read, so memory stays flat for any size.
+    """
+    rows = iter_activity_rows(user_id=user_id, date_from=date_from, date_to=date_to)
+    if format == "csv":
+        body, media_type = iter_csv(rows), "text/csv"
+    else:
+        body, media_type = iter_ndjson(rows), "application/x-ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=activities.{format}"}
     )
 
 @router.get("/my-activity", response_model=dict)
@@ -133,8 +206,12 @@ def get_my_activity(
             "user_email": current_user.email,
             "user_name": f"{current_user.firstname} {current_user.lastname}",
             "reference_image": session.reference_image,
+            "reference_image_url": s3_helper.download_url(session.reference_image),
             "input_prompt": session.input_prompt,
             "output_path": session.output_path,
+            "output_url": s3_helper.download_url(session.output_path),
+            "thumbnail_url": s3_helper.download_url(session.thumbnail_key),
+            "preview_url": s3_helper.download_url(session.preview_key),
             "approved": session.approved,
             "attempts": session.attempts,
             "created_at": session.created_at.isoformat() if session.created_at else None
@@ -1,14 +1,32 @@
-from fastapi import APIRouter, Depends, File, Form, UploadFile, HTTPException
-from typing import Optional
+from fastapi import APIRouter, Depends, File, Form, UploadFile, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional
+from datetime import datetime
+import asyncio
 import json
+import time
 # from fastapi import HTTPException
 from app.helper.response_helper import success_response, error_response
-from app.helper.runpod_helper import submit_job, wait_for_output
-from app.helper.s3_helper import s3_helper
+from app.helper.job_helper import generation_pool, GenerationJob, BATCH_MAX_ITEMS, BATCH_DEFAULT_PARALLELISM, BATCH_MAX_PARALLELISM
+from app.helper.s3_helper import s3_helper, FileTooLargeError, InvalidUploadError
+from app.helper.derivative_helper import derivative_pipeline
+from app.helper.reference_helper import reference_normalizer
+from app.helper.image_helper import ImagePoolBusyError, IMAGE_POOL_RETRY_AFTER
+from app.helper.cache_helper import generation_cache, generation_cache_key
+from app.helper.pagination_helper import paginate_sessions, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.helper.events_helper import generation_events, iter_session_events, EVENT_KEEPALIVE_SECONDS
+from app.helper.admission_helper import admission_controller, AdmissionRejectedError
+from app.helper.scheduler_helper import priority_class_for
+from sqlalchemy import select, update
 from sqlalchemy.orm import Session
-from app.deps import get_db, get_current_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.deps import get_db, get_async_db, get_current_user, authenticate_token
+from app.database import AsyncSessionLocal
 
-from app.models import GenerationSession, User, GenerationAttempt
+from app.models import GenerationSession, User, GenerationAttempt, GenerationBatch
+from app.schemas import UploadUrlRequest
+from app.enums.generation_status import GenerationStatus
 import os
 from uuid import uuid4
 from dotenv import load_dotenv
@@ -17,73 +35,185 @@ load_dotenv()
 
 router = APIRouter(prefix="/generate", tags=["generation"])
 
+QUEUE_FULL_MESSAGE = "Generation queue is full, try again later"
+
+def admission_rejected_response(e: AdmissionRejectedError):
+    response = error_response(str(e), status_code=429)
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+def image_pool_busy_response(e: ImagePoolBusyError):
+    response = error_response(str(e), status_code=503)
+    response.headers["Retry-After"] = str(IMAGE_POOL_RETRY_AFTER)
+    return response
+
+def queue_full_response():
+    return admission_rejected_response(
+        AdmissionRejectedError(QUEUE_FULL_MESSAGE, admission_controller.retry_after())
+    )
+
+async def fail_unqueued_session(db: AsyncSession, session: GenerationSession):
+    """
+    The pool filled up between the is_full() check and enqueue (uploads and
+    commits run in between); fail the session so it does not stay pending.
+    """
+    session.status = GenerationStatus.FAILED.value
+    session.error_message = QUEUE_FULL_MESSAGE
+    await db.commit()
+    generation_events.publish(session.session_id, GenerationStatus.FAILED.value, error=QUEUE_FULL_MESSAGE)
+
+@router.post("/uploads")
+def create_upload_url(payload: UploadUrlRequest, current_user: User = Depends(get_current_user)):
+    """
+    Presigned URLs for uploading a reference image straight to S3.
+    Upload with either the PUT (send the returned headers; only offered
+    when size is given) or the POST form fields, then pass s3_key as
+    reference_image_key / new_image_key.
+    """
+    if payload.size is not None and payload.size <= 0:
+        return error_response("size must be positive", status_code=400)
+    try:
+        upload = s3_helper.create_presigned_upload(current_user.user_id, payload.content_type, payload.size)
+    except InvalidUploadError as e:
+        return error_response(str(e), status_code=400)
+    except FileTooLargeError as e:
+        return error_response(str(e), status_code=413)
+    except Exception as e:
+        return error_response("Failed to create upload URL", dev_message=str(e), status_code=500)
+
+    return success_response("Upload URL created successfully", data=upload, status_code=201)
+
 @router.post("/")
 async def generate(
     input_prompt: str = Form(...),
     reference_image: Optional[UploadFile] = File(None),
+    reference_image_key: Optional[str] = Form(None),
+    no_cache: bool = Form(False),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    tickets = []
     try:
         reference_images_list = []  # List for multiple images
         single_reference_image = None
 
+        if reference_image and reference_image_key:
+            return error_response("Send either reference_image or reference_image_key, not both", status_code=400)
+
         if reference_image and reference_image != "":
-            reference_s3_key = s3_helper.upload_file(
-                reference_image, 
-                folder = "image-generation"
-            )
+            try:
+                reference_s3_key = await reference_normalizer.store_upload(
+                    reference_image, 
+                    folder = "image-generation"
+                )
+            finally:
+                await reference_image.close()
             single_reference_image = reference_s3_key["s3_key"]
             reference_images_list.append(single_reference_image)
-    
-        job_id = await submit_job(input_prompt, reference_images_list)  
-        runpod_result = await wait_for_output(job_id)        
+        elif reference_image_key:
+            # Uploaded by the client through a presigned URL
+            single_reference_image = await s3_helper.verify_upload_async(
+                reference_image_key,
+                current_user.user_id,
+                any_user=current_user.user_type in [1, 2]
+            )
+            single_reference_image = await reference_normalizer.normalize_stored(single_reference_image, folder="image-generation")
+            reference_images_list.append(single_reference_image)
 
-        generated_image_url = runpod_result.get("image_key", "")   
-        
+        cache_key = generation_cache_key(input_prompt, reference_images_list) if generation_cache.enabled else None
+        cached_image_key = await generation_cache.get(cache_key) if cache_key and not no_cache else None
+
+        if not cached_image_key:
+            if generation_pool.is_full():
+                return queue_full_response()
+            tickets = admission_controller.admit(current_user.user_id)
+    
         session = GenerationSession(
             user_id= current_user.user_id,
             reference_image= single_reference_image,
             reference_images=json.dumps(reference_images_list) if reference_images_list else None,
             input_prompt=input_prompt,
-            output_path= generated_image_url,
+            output_path=cached_image_key,
             approved=False,
-            attempts=1
+            attempts=1,
+            status=GenerationStatus.COMPLETED.value if cached_image_key else GenerationStatus.PENDING.value
         )
 
         db.add(session)
-        db.commit()
-        db.refresh(session)
-
-        attempt = GenerationAttempt(
-            session_id=session.session_id,
-            prompt=input_prompt,
-            reference_image=single_reference_image,
-            reference_images=json.dumps(reference_images_list) if reference_images_list else None,
-            output_path=generated_image_url,
-            attempt_number=1
-        )
-        db.add(attempt)
-        db.commit()
-
+        await db.commit()
+        await db.refresh(session)
+
+        if cached_image_key:
+            attempt = GenerationAttempt(
+                session_id=session.session_id,
+                prompt=input_prompt,
+                reference_image=single_reference_image,
+                reference_images=json.dumps(reference_images_list) if reference_images_list else None,
+                output_path=cached_image_key,
+                attempt_number=1
+            )
+            db.add(attempt)
+            await db.commit()
+            derivative_pipeline.enqueue(attempt.id, session.session_id, cached_image_key)
+            generation_events.publish(
+                session.session_id,
+                GenerationStatus.COMPLETED.value,
+                image_key=cached_image_key,
+                image_url=s3_helper.download_url(cached_image_key),
+                attempt_number=1
+            )
+        else:
+            try:
+                generation_pool.enqueue(GenerationJob(
+                    session_id=session.session_id,
+                    prompt=input_prompt,
+                    attempt_number=1,
+                    reference_image=single_reference_image,
+                    reference_images=reference_images_list,
+                    stored_reference_images=reference_images_list,
+                    cache_key=cache_key,
+                    ticket=tickets[0],
+                    coalesce=not no_cache
+                ), priority_class_for(current_user.user_type))
+            except asyncio.QueueFull:
+                await fail_unqueued_session(db, session)
+                admission_controller.release_unstarted(tickets)
+                return queue_full_response()
+            generation_events.publish(session.session_id, "queued")
 
         return success_response(
-            "Generation session created successfully",
+            "Generation served from cache" if cached_image_key else "Generation job queued successfully",
             data= {
                 "session_id": session.session_id,
                 "user_id": session.user_id,
+                "status": session.status,
+                "status_url": f"/api/generate/status/{session.session_id}",
+                "cached": cached_image_key is not None,
                 "reference_image" : single_reference_image,
-                "reference_images": json.loads(session.reference_images) if session.reference_images and session.reference_images != "" else [],
+                "reference_image_url": s3_helper.download_url(single_reference_image),
+                "reference_images": reference_images_list,
+                "reference_image_urls": s3_helper.download_urls_for(reference_images_list),
                 "input_prompt": session.input_prompt,
                 "output_path": session.output_path,
+                "output_url": s3_helper.download_url(session.output_path),
                 "approved": session.approved,
                 "attempts": session.attempts,
                 "created_at": str(session.created_at),
                 "updated_at": str(session.updated_at)
             },
-            status_code=200
+            status_code=200 if cached_image_key else 202
         )
+    except AdmissionRejectedError as e:
+        return admission_rejected_response(e)
+    except InvalidUploadError as e:
+        return error_response(str(e), status_code=400)
+    except ImagePoolBusyError as e:
+        return image_pool_busy_response(e)
+    except FileTooLargeError as e:
+        admission_controller.release_unstarted(tickets)
+        return error_response(str(e), status_code=413)
     except Exception as e:
+        admission_controller.release_unstarted(tickets)
 
         # Capture any unexpected error and return detailed message in development
         return error_response(
@@ -92,6 +222,246 @@ async def generate(
             status_code=500
         )
 
+def parse_batch_items(items: str, reference_count: int) -> list:
+    """
+    Validate the batch items JSON: a list of prompts, or of objects with a
+    prompt and the indexes of the reference_images uploads it uses.
+    """
+    try:
+        parsed = json.loads(items)
+    except ValueError:
+        raise ValueError("items must be a JSON list")
+    if not isinstance(parsed, list) or not parsed:
+        raise ValueError("items must be a non-empty JSON list")
+    if len(parsed) > BATCH_MAX_ITEMS:
+        raise ValueError(f"A batch can contain at most {BATCH_MAX_ITEMS} items")
+
+    batch_items = []
+    for index, item in enumerate(parsed):
+        if isinstance(item, str):
+            item = {"prompt": item}
+        if not isinstance(item, dict) or not isinstance(item.get("prompt"), str) or not item["prompt"].strip():
+            raise ValueError(f"Item {index} must have a non-empty prompt")
+
+        references = item.get("reference_images", [])
+        if not isinstance(references, list) or any(
+            not isinstance(ref, int) or ref < 0 or ref >= reference_count for ref in references
+        ):
+            raise ValueError(f"Item {index} references an unknown reference image")
+        batch_items.append({"prompt": item["prompt"], "reference_images": list(dict.fromkeys(references))})
+    return batch_items
+
+@router.post("/batch")
+async def generate_batch(
+    items: str = Form(...),
+    shared_reference_images: Optional[List[UploadFile]] = File(None),
+    reference_images: Optional[List[UploadFile]] = File(None),
+    parallelism: int = Form(BATCH_DEFAULT_PARALLELISM),
+    no_cache: bool = Form(False),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Create one generation session per item and run them as a batch.
+    - items: JSON list of prompts or {"prompt": ..., "reference_images": [indexes into reference_images]}
+    - shared_reference_images: used by every item
+    - parallelism: how many RunPod jobs of this batch may run at once
+    """
+    tickets = []
+    try:
+        shared_reference_images = shared_reference_images or []
+        reference_images = reference_images or []
+
+        try:
+            batch_items = parse_batch_items(items, len(reference_images))
+        except ValueError as e:
+            return error_response(str(e), status_code=400)
+
+        if not 1 <= parallelism <= BATCH_MAX_PARALLELISM:
+            return error_response(f"parallelism must be between 1 and {BATCH_MAX_PARALLELISM}", status_code=400)
+
+        if not generation_pool.can_start_batch():
+            return error_response("Too many batches running, try again later", status_code=503)
+
+        # Each file is uploaded once; identical contents share one S3 object
+        try:
+            uploads = await reference_normalizer.store_uploads(
+                shared_reference_images + reference_images,
+                folder="image-generation"
+            )
+        finally:
+            for upload in shared_reference_images + reference_images:
+                await upload.close()
+        shared_keys = [upload["s3_key"] for upload in uploads[:len(shared_reference_images)]]
+        item_keys = [upload["s3_key"] for upload in uploads[len(shared_reference_images):]]
+
+        batch = GenerationBatch(user_id=current_user.user_id, total_items=len(batch_items), parallelism=parallelism)
+        db.add(batch)
+        await db.flush()
+
+        sessions = []
+        for item in batch_items:
+            item_references = list(dict.fromkeys(shared_keys + [item_keys[i] for i in item["reference_images"]]))
+            cache_key = generation_cache_key(item["prompt"], item_references) if generation_cache.enabled else None
+            cached_image_key = await generation_cache.get(cache_key) if cache_key and not no_cache else None
+
+            item.update(references=item_references, cache_key=cache_key, cached_image_key=cached_image_key)
+            sessions.append(GenerationSession(
+                user_id=current_user.user_id,
+                batch_id=batch.batch_id,
+                reference_image=item_references[0] if item_references else None,
+                reference_images=json.dumps(item_references) if item_references else None,
+                input_prompt=item["prompt"],
+                output_path=cached_image_key,
+                approved=False,
+                attempts=1,
+                status=GenerationStatus.COMPLETED.value if cached_image_key else GenerationStatus.PENDING.value
+            ))
+
+        uncached = sum(1 for item in batch_items if not item["cached_image_key"])
+        if uncached:
+            tickets = admission_controller.admit(current_user.user_id, jobs=uncached)
+
+        db.add_all(sessions)
+        await db.flush()
+
+        cached_attempts = [
+            GenerationAttempt(
+                session_id=session.session_id,
+                prompt=item["prompt"],
+                reference_image=session.reference_image,
+                reference_images=session.reference_images,
+                output_path=item["cached_image_key"],
+                attempt_number=1
+            )
+            for session, item in zip(sessions, batch_items) if item["cached_image_key"]
+        ]
+        db.add_all(cached_attempts)
+        await db.commit()
+        for attempt in cached_attempts:
+            derivative_pipeline.enqueue(attempt.id, attempt.session_id, attempt.output_path)
+
+        jobs = []
+        flight_keys = set()
+        for session, item in zip(sessions, batch_items):
+            if item["cached_image_key"]:
+                generation_events.publish(
+                    session.session_id,
+                    GenerationStatus.COMPLETED.value,
+                    image_key=item["cached_image_key"],
+                    image_url=s3_helper.download_url(item["cached_image_key"]),
+                    attempt_number=1
+                )
+                continue
+            generation_events.publish(session.session_id, "queued")
+            # Repeated items are separate generations, not one shared job
+            flight_key = generation_cache_key(item["prompt"], item["references"])
+            jobs.append(GenerationJob(
+                session_id=session.session_id,
+                prompt=item["prompt"],
+                attempt_number=1,
+                reference_image=session.reference_image,
+                reference_images=item["references"],
+                stored_reference_images=item["references"],
+                cache_key=item["cache_key"],
+                ticket=tickets[len(jobs)],
+                coalesce=not no_cache and flight_key not in flight_keys
+            ))
+            flight_keys.add(flight_key)
+        if jobs:
+            generation_pool.start_batch(jobs, parallelism, priority_class_for(current_user.user_type, interactive=False))
+
+        return success_response(
+            "Batch generation queued successfully",
+            data={
+                "batch_id": batch.batch_id,
+                "status_url": f"/api/generate/batch/{batch.batch_id}",
+                "total_items": batch.total_items,
+                "parallelism": batch.parallelism,
+                "items": [
+                    {
+                        "index": index,
+                        "session_id": session.session_id,
+                        "status": session.status,
+                        "cached": item["cached_image_key"] is not None,
+                        "input_prompt": session.input_prompt,
+                        "reference_images": item["references"],
+                        "reference_image_urls": s3_helper.download_urls_for(item["references"]),
+                        "output_path": session.output_path,
+                        "output_url": s3_helper.download_url(session.output_path)
+                    }
+                    for index, (session, item) in enumerate(zip(sessions, batch_items))
+                ]
+            },
+            status_code=202 if jobs else 200
+        )
+    except AdmissionRejectedError as e:
+        return admission_rejected_response(e)
+    except InvalidUploadError as e:
+        return error_response(str(e), status_code=400)
+    except ImagePoolBusyError as e:
+        return image_pool_busy_response(e)
+    except FileTooLargeError as e:
+        return error_response(str(e), status_code=413)
+    except Exception as e:
+        admission_controller.release_unstarted(tickets)
+        return error_response("Failed to create generation batch", dev_message=str(e), status_code=500)
+
+@router.get("/batch/{batch_id}")
+async def get_batch_status(
+    batch_id: int,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Per-item status and results of a batch.
+    """
+    batch = await db.get(GenerationBatch, batch_id)
+    if not batch:
+        return error_response("Batch not found", status_code=404)
+
+    # Only owner or admin can view
+    if current_user.user_type not in [1, 2]:
+        if batch.user_id != current_user.user_id:
+            return error_response("Not authorized", status_code=403)
+
+    sessions = (await db.execute(
+        select(GenerationSession)
+        .where(GenerationSession.batch_id == batch_id)
+        .order_by(GenerationSession.session_id)
+    )).scalars().all()
+
+    counts = {status.value: 0 for status in GenerationStatus}
+    for session in sessions:
+        counts[session.status] = counts.get(session.status, 0) + 1
+
+    return success_response(
+        "Batch status retrieved successfully",
+        data={
+            "batch_id": batch.batch_id,
+            "total_items": batch.total_items,
+            "parallelism": batch.parallelism,
+            "counts": counts,
+            "done": counts[GenerationStatus.COMPLETED.value] + counts[GenerationStatus.FAILED.value] == len(sessions),
+            "created_at": str(batch.created_at),
+            "items": [
+                {
+                    "index": index,
+                    "session_id": session.session_id,
+                    "status": session.status,
+                    "job_id": session.job_id,
+                    "input_prompt": session.input_prompt,
+                    "output_path": session.output_path,
+                    "output_url": s3_helper.download_url(session.output_path),
+                    "thumbnail_url": s3_helper.download_url(session.thumbnail_key),
+                    "preview_url": s3_helper.download_url(session.preview_key),
+                    "error": session.error_message
+                }
+                for index, session in enumerate(sessions)
+            ]
+        }
+    )
+
 @router.post("/approve/{session_id}")
 def approve_generated_image(session_id: int, current_user: User = Depends(get_current_user),db: Session = Depends(get_db)):
     """
@@ -113,7 +483,8 @@ def approve_generated_image(session_id: int, current_user: User = Depends(get_cu
             "Image approved successfully",
             data={
                 "session_id": session.session_id,
-                "final_output_image": session.output_path
+                "final_output_image": session.output_path,
+                "final_output_url": s3_helper.download_url(session.output_path)
             }
         )
     except Exception as e:
@@ -127,20 +498,30 @@ async def regenerate_image_with_new_prompt(
     new_prompt: str = Form(...),
     use_previous_image: bool = Form(False),
     new_image: Optional[UploadFile] = File(None),
+    new_image_key: Optional[str] = Form(None),
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Allows user to request a new generation using a modified prompt.
     """
+    tickets = []
     try:
-        session = db.query(GenerationSession).filter(GenerationSession.session_id == session_id).first()
+        session = (await db.execute(
+            select(GenerationSession).where(GenerationSession.session_id == session_id)
+        )).scalar_one_or_none()
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
 
         if current_user.user_type not in [1, 2]:
             if session.user_id != current_user.user_id:
                 return error_response("Not authorized", status_code=403)
+
+        if session.status in [GenerationStatus.PENDING.value, GenerationStatus.RUNNING.value]:
+            return error_response("A generation is already in progress for this session", status_code=409)
+
+        if generation_pool.is_full():
+            return queue_full_response()
             
         all_reference_images = []
         if session.reference_images:
@@ -151,13 +532,28 @@ async def regenerate_image_with_new_prompt(
         single_reference_image = None 
         uploaded_new_image_url = None
        
-        if new_image:
-            # Upload new image to S3
-            new_image_s3_key = s3_helper.upload_file(
-                new_image, 
-                folder="image-generation"
-            )
-            uploaded_new_image_url = new_image_s3_key["s3_key"]
+        if new_image and new_image_key:
+            return error_response("Send either new_image or new_image_key, not both", status_code=400)
+
+        if new_image or new_image_key:
+            if new_image:
+                # Upload new image to S3
+                try:
+                    new_image_s3_key = await reference_normalizer.store_upload(
+                        new_image, 
+                        folder="image-generation"
+                    )
+                finally:
+                    await new_image.close()
+                uploaded_new_image_url = new_image_s3_key["s3_key"]
+            else:
+                # Uploaded by the client through a presigned URL
+                uploaded_new_image_url = await s3_helper.verify_upload_async(
+                    new_image_key,
+                    current_user.user_id,
+                    any_user=current_user.user_type in [1, 2]
+                )
+                uploaded_new_image_url = await reference_normalizer.normalize_stored(uploaded_new_image_url, folder="image-generation")
             new_reference_images.append(uploaded_new_image_url)
 
             if uploaded_new_image_url not in all_reference_images:
@@ -180,77 +576,125 @@ async def regenerate_image_with_new_prompt(
                 single_reference_image = previous_image
 
 
-        job_id = await submit_job(new_prompt,new_reference_images)
-        runpod_result = await wait_for_output(job_id)
-       
-        new_image_url = runpod_result.get("image_key", "")
-
-        # Update DB
-        session.input_prompt = new_prompt
-        session.reference_image = single_reference_image
-        session.reference_images = json.dumps(all_reference_images) if all_reference_images else None  
-        session.output_path = new_image_url
-        session.attempts += 1
-        session.approved = False
-        db.commit()
+        tickets = admission_controller.admit(current_user.user_id)
 
-        attempt = GenerationAttempt(
-            session_id=session_id,
-            prompt=new_prompt,
-            reference_image=single_reference_image,
-            reference_images=json.dumps(all_reference_images),
-            output_path=new_image_url,
-            attempt_number=session.attempts
+        # Update DB only if no other request started a generation since the
+        # check above (uploads can take a while)
+        claimed = await db.execute(
+            update(GenerationSession)
+            .where(
+                GenerationSession.session_id == session.session_id,
+                GenerationSession.status.not_in([GenerationStatus.PENDING.value, GenerationStatus.RUNNING.value])
+            )
+            .values(
+                input_prompt=new_prompt,
+                reference_image=single_reference_image,
+                reference_images=json.dumps(all_reference_images) if all_reference_images else None,
+                attempts=GenerationSession.attempts + 1,
+                approved=False,
+                status=GenerationStatus.PENDING.value,
+                error_message=None
+            )
+            .execution_options(synchronize_session=False)
         )
-        db.add(attempt)
-        db.commit()
-
+        if claimed.rowcount == 0:
+            await db.rollback()
+            admission_controller.release_unstarted(tickets)
+            return error_response("A generation is already in progress for this session", status_code=409)
+        await db.commit()
+        await db.refresh(session)
+
+        try:
+            generation_pool.enqueue(GenerationJob(
+                session_id=session.session_id,
+                prompt=new_prompt,
+                attempt_number=session.attempts,
+                reference_image=single_reference_image,
+                reference_images=new_reference_images,
+                stored_reference_images=all_reference_images,
+                ticket=tickets[0],
+                # Asking again means asking for a new image, not the one being made
+                coalesce=False
+            ), priority_class_for(current_user.user_type))
+        except asyncio.QueueFull:
+            await fail_unqueued_session(db, session)
+            admission_controller.release_unstarted(tickets)
+            return queue_full_response()
+        generation_events.publish(session.session_id, "queued")
 
         return success_response(
-            "New image generated successfully",
+            "New generation job queued successfully",
             data={
                 "session_id": session.session_id,
+                "status": session.status,
+                "status_url": f"/api/generate/status/{session.session_id}",
                 "new_input_prompt": session.input_prompt,
                 "reference_image": session.reference_image,
-                "reference_images": json.loads(session.reference_images) if session.reference_images else [],
+                "reference_image_url": s3_helper.download_url(session.reference_image),
+                "reference_images": all_reference_images,
+                "reference_image_urls": s3_helper.download_urls_for(all_reference_images),
                 "new_uploaded_image": uploaded_new_image_url,
-                "new_output_dir": session.output_path,
                 "attempts": session.attempts,
                 "created_at": str(session.created_at),
                 "updated_at": str(session.updated_at)
-            }
+            },
+            status_code=202
         )
+    except AdmissionRejectedError as e:
+        return admission_rejected_response(e)
+    except InvalidUploadError as e:
+        return error_response(str(e), status_code=400)
+    except ImagePoolBusyError as e:
+        return image_pool_busy_response(e)
+    except FileTooLargeError as e:
+        admission_controller.release_unstarted(tickets)
+        return error_response(str(e), status_code=413)
     except Exception as e:
+        admission_controller.release_unstarted(tickets)
         return error_response("Failed to regenerate image", dev_message=str(e), status_code=500)
 
     
 @router.get("/list")
-def get_all_generations(current_user: User = Depends(get_current_user),  db: Session = Depends(get_db)):
+def get_all_generations(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    user_id: Optional[int] = None,
+    approved: Optional[bool] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     """
-    Fetch all generation sessions.
+    Fetch generation sessions, newest first, one page at a time.
     - Normal users: only their own sessions
-    - Admin/SuperAdmin: all sessions
+    - Admin/SuperAdmin: all sessions, optionally filtered by user_id
+    Pass the returned next_cursor to fetch the following page.
     """
     try:
-       
-        if current_user.user_type in [1, 2]:  # 1=SuperAdmin, 2=Admin
-            sessions = db.query(GenerationSession).all()
-        else:
+        if current_user.user_type not in [1, 2]:  # 1=SuperAdmin, 2=Admin
             # Normal user sees only their own
-            sessions = db.query(GenerationSession).filter(
-                GenerationSession.user_id == current_user.user_id
-            ).all()
+            user_id = current_user.user_id
+
+        try:
+            rows, next_cursor = paginate_sessions(
+                db,
+                cursor=cursor,
+                limit=limit,
+                user_id=user_id,
+                approved=approved,
+                date_from=date_from,
+                date_to=date_to
+            )
+        except ValueError as e:
+            return error_response(str(e), status_code=400)
             
-        if not sessions:
-            return success_response("No generation sessions found", data=[])
+        if not rows and not cursor:
+            return success_response("No generation sessions found", data={"sessions": [], "next_cursor": None})
         
         session_data = []
 
-        for s in sessions:
-
-            user = db.query(User).filter(User.user_id == s.user_id).first()
-            if not user:
-                raise HTTPException(status_code=404, detail="User not found")
+        for s, user in rows:
 
             user_details = {
                 "user_id": user.user_id,
@@ -265,9 +709,16 @@ def get_all_generations(current_user: User = Depends(get_current_user),  db: Ses
                 "user_id": s.user_id,
                 "input_prompt": s.input_prompt,
                 "reference_image": s.reference_image,
+                "reference_image_url": s3_helper.download_url(s.reference_image),
                 "output_path": s.output_path,
+                "output_url": s3_helper.download_url(s.output_path),
+                "thumbnail_key": s.thumbnail_key,
+                "thumbnail_url": s3_helper.download_url(s.thumbnail_key),
+                "preview_key": s.preview_key,
+                "preview_url": s3_helper.download_url(s.preview_key),
                 "approved": s.approved,
                 "attempts": s.attempts,
+                "status": s.status,
                 "created_at": str(s.created_at),
                 "updated_at": str(s.updated_at),
                 "user_details" : user_details
@@ -275,7 +726,7 @@ def get_all_generations(current_user: User = Depends(get_current_user),  db: Ses
 
         return success_response(
             "Generation sessions fetched successfully",
-            data= session_data
+            data= {"sessions": session_data, "next_cursor": next_cursor}
         )
 
     except Exception as e:
@@ -285,6 +736,7 @@ def get_all_generations(current_user: User = Depends(get_current_user),  db: Ses
 @router.get("/user/details/{session_id}")
 def get_user_with_session(
     session_id: int,
+    current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """
@@ -299,6 +751,10 @@ def get_user_with_session(
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
 
+        if current_user.user_type not in [1, 2]:
+            if session.user_id != current_user.user_id:
+                return error_response("Not authorized", status_code=403)
+
         # Fetch the user who created the session
         user = db.query(User).filter(User.user_id == session.user_id).first()
 
@@ -319,7 +775,11 @@ def get_user_with_session(
             "session_id": session.session_id,
             "input_prompt": session.input_prompt,
             "reference_image": session.reference_image,
+            "reference_image_url": s3_helper.download_url(session.reference_image),
             "output_path": session.output_path,
+            "output_url": s3_helper.download_url(session.output_path),
+            "thumbnail_url": s3_helper.download_url(session.thumbnail_key),
+            "preview_url": s3_helper.download_url(session.preview_key),
             "approved": session.approved,
             "attempts": session.attempts,
             "created_at": str(session.created_at),
@@ -339,6 +799,129 @@ def get_user_with_session(
             status_code=500
         )
 
+@router.get("/status/{session_id}")
+def get_generation_status(session_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    Report the state of the latest generation job for a session.
+    """
+    session = db.query(GenerationSession).filter(
+        GenerationSession.session_id == session_id
+    ).first()
+
+    if not session:
+        return error_response("Session not found", status_code=404)
+
+    # Only owner or admin can view
+    if current_user.user_type not in [1, 2]:
+        if session.user_id != current_user.user_id:
+            return error_response("Not authorized", status_code=403)
+
+    return success_response(
+        "Generation status retrieved successfully",
+        data={
+            "session_id": session.session_id,
+            "status": session.status,
+            "job_id": session.job_id,
+            "output_path": session.output_path,
+            "output_url": s3_helper.download_url(session.output_path),
+            "error": session.error_message,
+            "attempts": session.attempts,
+            "updated_at": str(session.updated_at)
+        }
+    )
+
+def initial_session_event(session: GenerationSession) -> dict:
+    """
+    Current state of a session for a new subscriber: the latest published
+    event while the job is in flight, otherwise what the DB says.
+    """
+    if session.status in [GenerationStatus.PENDING.value, GenerationStatus.RUNNING.value]:
+        last_event = generation_events.last_event(session.session_id)
+        if last_event is not None:
+            return last_event
+
+    event = {
+        "session_id": session.session_id,
+        "state": {"pending": "queued", "running": "submitted"}.get(session.status, session.status),
+        "timestamp": time.time()
+    }
+    if session.status == GenerationStatus.COMPLETED.value:
+        event["image_key"] = session.output_path
+        event["image_url"] = s3_helper.download_url(session.output_path)
+        event["attempt_number"] = session.attempts
+    elif session.status == GenerationStatus.FAILED.value:
+        event["error"] = session.error_message
+    return event
+
+@router.get("/events/{session_id}")
+async def stream_generation_events(
+    session_id: int,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Server-Sent Events stream of state changes for a session's generation:
+    queued, submitted, in_progress, then completed or failed.
+    """
+    # Not Depends(get_async_db): that session would stay checked out until
+    # the stream ends, pinning a pooled connection per subscriber
+    async with AsyncSessionLocal() as db:
+        session = (await db.execute(
+            select(GenerationSession).where(GenerationSession.session_id == session_id)
+        )).scalar_one_or_none()
+
+    if not session:
+        return error_response("Session not found", status_code=404)
+
+    # Only owner or admin can view
+    if current_user.user_type not in [1, 2]:
+        if session.user_id != current_user.user_id:
+            return error_response("Not authorized", status_code=403)
+
+    queue = generation_events.subscribe(session_id)
+    initial = initial_session_event(session)
+
+    async def sse_stream():
+        async for event in iter_session_events(session_id, queue, initial, EVENT_KEEPALIVE_SECONDS):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['state']}\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        sse_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/ws/{session_id}")
+async def generation_events_socket(websocket: WebSocket, session_id: int, token: str = ""):
+    """
+    WebSocket variant of /events/{session_id}; pass the access token as ?token=
+    """
+    try:
+        current_user = await run_in_threadpool(authenticate_token, token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    async with AsyncSessionLocal() as db:
+        session = (await db.execute(
+            select(GenerationSession).where(GenerationSession.session_id == session_id)
+        )).scalar_one_or_none()
+
+    if not session or (current_user.user_type not in [1, 2] and session.user_id != current_user.user_id):
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    queue = generation_events.subscribe(session_id)
+    try:
+        async for event in iter_session_events(session_id, queue, initial_session_event(session), EVENT_KEEPALIVE_SECONDS):
+            await websocket.send_json(event if event is not None else {"state": "keepalive"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
 @router.get("/session/{session_id}")
 def get_attempts(session_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
 
@@ -360,12 +943,20 @@ def get_attempts(session_id: int, db: Session = Depends(get_db), current_user: U
 
     attempt_list = []
     for a in attempts:
+        reference_images = json.loads(a.reference_images) if a.reference_images else []
         attempt_list.append({
             "attempt_number": a.attempt_number,
             "prompt": a.prompt,
             "reference_image": a.reference_image,
-            "reference_images": json.loads(a.reference_images) if a.reference_images else [],
+            "reference_image_url": s3_helper.download_url(a.reference_image),
+            "reference_images": reference_images,
+            "reference_image_urls": s3_helper.download_urls_for(reference_images),
             "output_path": a.output_path,
+            "output_url": s3_helper.download_url(a.output_path),
+            "thumbnail_key": a.thumbnail_key,
+            "thumbnail_url": s3_helper.download_url(a.thumbnail_key),
+            "preview_key": a.preview_key,
+            "preview_url": s3_helper.download_url(a.preview_key),
             "created_at": str(a.created_at),
             "updated_at": str(a.updated_at),
         })
@@ -0,0 +1,41 @@
+import hmac
+import os
+from fastapi import APIRouter, Request, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from dotenv import load_dotenv
+from app.helper.response_helper import error_response
+from app.helper.metrics_helper import register_gauge
+from app.helper.job_helper import generation_pool
+from app.helper.poller_helper import runpod_poller
+from app.helper.admission_helper import admission_controller
+from app.helper.password_helper import password_hasher
+from app.helper.events_helper import generation_events
+from app.helper.derivative_helper import derivative_pipeline
+
+load_dotenv()
+
+# Optional bearer token required from the scraper
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+router = APIRouter(tags=["metrics"])
+
+register_gauge("generation_queue_depth", "Generation jobs waiting for a worker", generation_pool.queue_depth)
+register_gauge("generation_active_batches", "Batches with unfinished jobs", generation_pool.active_batches)
+register_gauge("runpod_jobs_in_flight", "RunPod jobs awaiting a result", runpod_poller.in_flight)
+register_gauge("admission_waiting", "Admitted generation jobs waiting for a RunPod slot", lambda: admission_controller.waiting)
+register_gauge("admission_running", "Generation jobs holding a RunPod slot", lambda: admission_controller.running)
+register_gauge("password_pool_pending", "bcrypt operations queued or running", lambda: password_hasher.pending)
+register_gauge("image_derivative_queue_depth", "Outputs waiting for thumbnails", derivative_pipeline.queue_depth)
+register_gauge("generation_event_subscribers", "Open SSE/WebSocket progress streams", lambda: generation_events.stats()["subscribers"])
+
+@router.get("/metrics", include_in_schema=False)
+def get_metrics(request: Request):
+    """
+    Prometheus exposition of the app's counters, gauges and histograms.
+    """
+    if METRICS_TOKEN:
+        auth_header = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth_header, f"Bearer {METRICS_TOKEN}"):
+            return error_response("Not authorized", status_code=401)
+
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,73 @@
+from fastapi import APIRouter, Depends
+from app.helper.response_helper import success_response
+from app.helper.admission_helper import admission_controller
+from app.helper.job_helper import generation_pool
+from app.helper.poller_helper import runpod_poller
+from app.helper.singleflight_helper import runpod_singleflight
+from app.helper.cache_helper import generation_cache
+from app.helper.s3_helper import s3_helper
+from app.helper.password_helper import password_hasher
+from app.helper.events_helper import generation_events
+from app.helper.derivative_helper import derivative_pipeline
+from app.helper.reference_helper import reference_normalizer
+from app.enums.user_type import UserType
+from app.deps import require_role, principal_cache
+from app.models import User
+
+router = APIRouter(prefix="/system", tags=["system"])
+
+@router.get("/stats")
+def get_system_stats(current_user: User = Depends(require_role(UserType.ADMIN, UserType.SUPERADMIN))):
+    """
+    Counters for the generation pipeline.
+    """
+    return success_response(
+        "System stats retrieved successfully",
+        data={
+            "generation_queue": {
+                "depth": generation_pool.queue_depth(),
+                "max_size": generation_pool.max_queue,
+                "workers": generation_pool.workers,
+                "active_batches": generation_pool.active_batches(),
+                "classes": generation_pool.class_stats()
+            },
+            "runpod_poller": {
+                "in_flight": runpod_poller.in_flight(),
+                "status_calls": runpod_poller.status_calls,
+                "expected_runtime": round(runpod_poller.expected_runtime, 2)
+            },
+            "runpod_singleflight": runpod_singleflight.stats(),
+            "generation_cache": generation_cache.stats(),
+            "principal_cache": principal_cache.stats(),
+            "download_url_cache": s3_helper.download_urls.stats(),
+            "password_pool": password_hasher.stats(),
+            "event_subscriptions": generation_events.stats(),
+            "admission": admission_controller.stats(),
+            "derivatives": derivative_pipeline.stats(),
+            "reference_normalization": reference_normalizer.stats()
+        }
+    )
+
+@router.get("/load")
+def get_load():
+    """
+    Unauthenticated load report for load balancers: 200 while generation
+    work is being admitted, 503 with Retry-After once the queue is full.
+    """
+    accepting = admission_controller.accepting() and not generation_pool.is_full()
+    response = success_response(
+        "Accepting generation requests" if accepting else "Generation queue is full",
+        data={
+            "accepting": accepting,
+            "queue_depth": generation_pool.queue_depth(),
+            "max_queue": generation_pool.max_queue,
+            "waiting": admission_controller.waiting,
+            "max_waiting": admission_controller.max_waiting,
+            "running": admission_controller.running,
+            "max_running": admission_controller.max_running
+        },
+        status_code=200 if accepting else 503
+    )
+    if not accepting:
+        response.headers["Retry-After"] = str(admission_controller.retry_after())
+    return response
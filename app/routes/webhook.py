@@ -0,0 +1,39 @@
+from fastapi import APIRouter, Request
+import hmac
+from app.helper.response_helper import success_response, error_response
+from app.helper.runpod_helper import RUNPOD_WEBHOOK_SECRET
+from app.helper.poller_helper import runpod_poller, result_from_status
+from app.helper.job_helper import finish_untracked_job
+
+router = APIRouter(prefix="/runpod", tags=["runpod"])
+
+@router.post("/webhook")
+async def runpod_webhook(request: Request, token: str = ""):
+    """
+    Receive RunPod job completion callbacks and finish the matching generation.
+    """
+    if not RUNPOD_WEBHOOK_SECRET or not hmac.compare_digest(token, RUNPOD_WEBHOOK_SECRET):
+        return error_response("Invalid webhook token", status_code=401)
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        return error_response("Invalid webhook payload", status_code=400)
+    if not isinstance(payload, dict):
+        return error_response("Webhook payload must be a JSON object", status_code=400)
+
+    job_id = payload.get("id")
+    if not job_id:
+        return error_response("Missing job id", status_code=400)
+
+    result = result_from_status(payload)
+    if result is None:
+        return success_response("Job not finished yet", data={"job_id": job_id, "resolved": False})
+
+    resolved = runpod_poller.resolve(job_id, payload)
+    if not resolved:
+        # Nobody is waiting yet (callback raced the worker) or the worker is gone (restart)
+        runpod_poller.remember(job_id, payload)
+        resolved = await finish_untracked_job(job_id, result)
+
+    return success_response("Webhook processed", data={"job_id": job_id, "resolved": resolved})
@@ -27,4 +27,8 @@ class RefreshRequest(BaseModel):
 # ---------------- Generation ----------------
 class GenerationCreate(BaseModel):
     input_prompt: str
+
+class UploadUrlRequest(BaseModel):
+    content_type: str
+    size: Optional[int] = None
     
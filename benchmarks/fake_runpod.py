@@ -0,0 +1,205 @@
+"""
+Local stand-in for the RunPod serverless API.
+
+Run it next to the API and point the app at it:
+
+    uvicorn benchmarks.fake_runpod:app --port 8001
+    RUNPOD_BASE_URL=http://127.0.0.1:8001/v2 uvicorn app.main:app
+
+Job runtimes are drawn from FAKE_RUNPOD_LATENCY_DIST (fixed, uniform,
+normal, lognormal or exponential) with mean FAKE_RUNPOD_LATENCY seconds
+and spread FAKE_RUNPOD_LATENCY_SPREAD (standard deviation, or half-width
+for uniform). With FAKE_RUNPOD_WORKERS > 0 only that many jobs run at once
+and the rest wait IN_QUEUE, like a fixed pool of GPU workers.
+
+FAKE_RUNPOD_FAILURE_RATE of jobs end FAILED, and FAKE_RUNPOD_SUBMIT_ERROR_RATE
+of /run calls answer 500. When /run is called with a "webhook" URL the final
+status payload is POSTed to it, except for the fraction of jobs given by
+FAKE_RUNPOD_WEBHOOK_DROP_RATE, which have to be picked up by fallback polling.
+
+With FAKE_RUNPOD_OUTPUT_URL set to a bucket URL (e.g. the fake S3's
+http://127.0.0.1:8002/bench), every completed job first PUTs a PNG of
+FAKE_RUNPOD_OUTPUT_SIZE pixels square to its output key, so the image
+can be fetched and thumbnailed like a real output. With
+FAKE_RUNPOD_FETCH_INPUTS as well, jobs start by downloading their
+image_urls from that bucket, throttled to FAKE_RUNPOD_DOWNLOAD_MBPS
+(0 for unthrottled) like a worker's link; GET /_stats reports the
+input bytes and time spent.
+"""
+import asyncio
+import io
+import math
+import os
+import random
+import time
+from uuid import uuid4
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+FAKE_RUNPOD_LATENCY = float(os.getenv("FAKE_RUNPOD_LATENCY", "2"))
+FAKE_RUNPOD_LATENCY_DIST = os.getenv("FAKE_RUNPOD_LATENCY_DIST", "fixed")
+FAKE_RUNPOD_LATENCY_SPREAD = float(os.getenv("FAKE_RUNPOD_LATENCY_SPREAD", "0"))
+FAKE_RUNPOD_WORKERS = int(os.getenv("FAKE_RUNPOD_WORKERS", "0"))
+FAKE_RUNPOD_FAILURE_RATE = float(os.getenv("FAKE_RUNPOD_FAILURE_RATE", "0"))
+FAKE_RUNPOD_SUBMIT_ERROR_RATE = float(os.getenv("FAKE_RUNPOD_SUBMIT_ERROR_RATE", "0"))
+FAKE_RUNPOD_WEBHOOK_DROP_RATE = float(os.getenv("FAKE_RUNPOD_WEBHOOK_DROP_RATE", "0"))
+FAKE_RUNPOD_OUTPUT_URL = os.getenv("FAKE_RUNPOD_OUTPUT_URL", "").rstrip("/")
+FAKE_RUNPOD_OUTPUT_SIZE = int(os.getenv("FAKE_RUNPOD_OUTPUT_SIZE", "1024"))
+FAKE_RUNPOD_FETCH_INPUTS = os.getenv("FAKE_RUNPOD_FETCH_INPUTS", "false").lower() == "true"
+FAKE_RUNPOD_DOWNLOAD_MBPS = float(os.getenv("FAKE_RUNPOD_DOWNLOAD_MBPS", "0"))
+
+app = FastAPI(title="Fake RunPod")
+
+jobs = {}
+input_stats = {"jobs": 0, "images": 0, "bytes": 0, "seconds": 0.0}
+workers = asyncio.Semaphore(FAKE_RUNPOD_WORKERS) if FAKE_RUNPOD_WORKERS > 0 else None
+
+
+def sample_latency() -> float:
+    mean, spread = FAKE_RUNPOD_LATENCY, FAKE_RUNPOD_LATENCY_SPREAD
+    if FAKE_RUNPOD_LATENCY_DIST == "uniform":
+        latency = random.uniform(mean - spread, mean + spread)
+    elif FAKE_RUNPOD_LATENCY_DIST == "normal":
+        latency = random.gauss(mean, spread)
+    elif FAKE_RUNPOD_LATENCY_DIST == "lognormal":
+        # Parameters of the underlying normal for the requested mean and spread
+        sigma = math.sqrt(math.log(1 + (spread / mean) ** 2)) if mean > 0 else 0
+        latency = random.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma) if mean > 0 else 0
+    elif FAKE_RUNPOD_LATENCY_DIST == "exponential":
+        latency = random.expovariate(1 / mean) if mean > 0 else 0
+    else:
+        latency = mean
+    return max(0.0, latency)
+
+
+def output_key(job_id: str) -> str:
+    return f"image-generation/outputs/{job_id}.png"
+
+
+_output_image = None
+
+
+def output_image() -> bytes:
+    """
+    A generated-looking PNG (smooth gradients plus noise, so it neither
+    compresses to nothing nor to pure noise), rendered once.
+    """
+    global _output_image
+    if _output_image is None:
+        from PIL import Image
+
+        size = FAKE_RUNPOD_OUTPUT_SIZE
+        gradient = Image.radial_gradient("L").resize((size, size))
+        noise = Image.effect_noise((size, size), 24)
+        image = Image.merge("RGB", (gradient, noise, gradient.rotate(90)))
+        output = io.BytesIO()
+        image.save(output, format="PNG")
+        _output_image = output.getvalue()
+    return _output_image
+
+
+async def store_output(job_id: str):
+    async with httpx.AsyncClient() as client:
+        response = await client.put(
+            f"{FAKE_RUNPOD_OUTPUT_URL}/{output_key(job_id)}",
+            content=output_image(),
+            headers={"Content-Type": "image/png"}
+        )
+        response.raise_for_status()
+
+
+async def fetch_inputs(image_urls: list):
+    """
+    Download a job's reference images the way a worker would before
+    running inference, at the simulated link speed.
+    """
+    started_at = time.perf_counter()
+    size = 0
+    async with httpx.AsyncClient(timeout=120) as client:
+        for image_url in image_urls:
+            url = image_url if image_url.startswith(("http://", "https://")) else f"{FAKE_RUNPOD_OUTPUT_URL}/{image_url}"
+            response = await client.get(url)
+            response.raise_for_status()
+            size += len(response.content)
+    if FAKE_RUNPOD_DOWNLOAD_MBPS > 0:
+        await asyncio.sleep(max(0.0, size * 8 / (FAKE_RUNPOD_DOWNLOAD_MBPS * 1e6) - (time.perf_counter() - started_at)))
+    input_stats["jobs"] += 1
+    input_stats["images"] += len(image_urls)
+    input_stats["bytes"] += size
+    input_stats["seconds"] += time.perf_counter() - started_at
+
+
+def job_status(job_id: str) -> dict:
+    job = jobs[job_id]
+    status = {"id": job_id, "status": job["status"]}
+    if job["status"] == "COMPLETED":
+        status["output"] = {"image_key": output_key(job_id)}
+    elif job["status"] == "FAILED":
+        status["error"] = "Simulated worker failure"
+    return status
+
+
+async def run_job(job_id: str, webhook: str = None):
+    inputs_missing = False
+    if workers is not None:
+        await workers.acquire()
+    try:
+        if jobs[job_id]["status"] == "CANCELLED":
+            return
+        jobs[job_id]["status"] = "IN_PROGRESS"
+        image_urls = (jobs[job_id]["input"] or {}).get("image_urls") or []
+        if FAKE_RUNPOD_FETCH_INPUTS and FAKE_RUNPOD_OUTPUT_URL and image_urls:
+            try:
+                await fetch_inputs(image_urls)
+            except httpx.HTTPError as e:
+                print(f"Fetching inputs for {job_id} failed: {str(e)}")
+                inputs_missing = True
+        await asyncio.sleep(sample_latency())
+    finally:
+        if workers is not None:
+            workers.release()
+    if jobs[job_id]["status"] == "CANCELLED":
+        return
+    failed = inputs_missing or random.random() < FAKE_RUNPOD_FAILURE_RATE
+    if not failed and FAKE_RUNPOD_OUTPUT_URL:
+        await store_output(job_id)
+    jobs[job_id]["status"] = "FAILED" if failed else "COMPLETED"
+
+    if webhook and random.random() >= FAKE_RUNPOD_WEBHOOK_DROP_RATE:
+        async with httpx.AsyncClient() as client:
+            try:
+                await client.post(webhook, json=job_status(job_id))
+            except httpx.HTTPError as e:
+                print(f"Webhook delivery for {job_id} failed: {str(e)}")
+
+
+@app.post("/v2/{endpoint}/run")
+async def run(endpoint: str, request: Request):
+    if random.random() < FAKE_RUNPOD_SUBMIT_ERROR_RATE:
+        return JSONResponse(status_code=500, content={"error": "Simulated submit failure"})
+
+    body = await request.json()
+    job_id = str(uuid4())
+    jobs[job_id] = {"status": "IN_QUEUE", "input": body.get("input")}
+    asyncio.create_task(run_job(job_id, body.get("webhook")))
+    return {"id": job_id, "status": "IN_QUEUE"}
+
+
+@app.get("/v2/{endpoint}/status/{job_id}")
+async def status(endpoint: str, job_id: str):
+    if job_id not in jobs:
+        return JSONResponse(status_code=404, content={"error": "job not found"})
+    return job_status(job_id)
+
+
+@app.get("/_stats")
+async def stats():
+    return input_stats
+
+
+@app.post("/v2/{endpoint}/cancel/{job_id}")
+async def cancel(endpoint: str, job_id: str):
+    if job_id in jobs and jobs[job_id]["status"] not in ["COMPLETED", "FAILED"]:
+        jobs[job_id]["status"] = "CANCELLED"
+    return {"id": job_id, "status": jobs.get(job_id, {}).get("status")}
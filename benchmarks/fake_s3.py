@@ -0,0 +1,172 @@
+"""
+Local, in-memory stand-in for the parts of the S3 API the app uses:
+buckets, PutObject, browser-style POST uploads, GetObject/HeadObject,
+DeleteObject and multipart uploads, all with path-style addressing.
+Signatures and POST policies are not checked.
+
+Run it next to the API and point the app at it:
+
+    uvicorn benchmarks.fake_s3:app --port 8002
+    S3_ENDPOINT_URL=http://127.0.0.1:8002 BUCKET_NAME=bench uvicorn app.main:app
+
+Buckets are created on first write. Every request is delayed by
+FAKE_S3_LATENCY seconds to approximate the network round trip. Object
+bytes written and read so far are reported by GET /_stats.
+"""
+import asyncio
+import hashlib
+import os
+from collections import defaultdict
+from uuid import uuid4
+from fastapi import FastAPI, Request, Response
+
+FAKE_S3_LATENCY = float(os.getenv("FAKE_S3_LATENCY", "0"))
+
+app = FastAPI(title="Fake S3")
+
+buckets = defaultdict(dict)
+multipart_uploads = {}
+traffic = {"bytes_in": 0, "bytes_out": 0, "puts": 0, "gets": 0}
+
+
+def decode_aws_chunked(body: bytes) -> bytes:
+    """
+    Strip the aws-chunked framing boto3 uses when it streams a body with a
+    trailing checksum: <hex size>[;signature]\\r\\n<data>\\r\\n ... 0\\r\\n<trailers>
+    """
+    data = bytearray()
+    position = 0
+    while True:
+        line_end = body.index(b"\r\n", position)
+        size = int(body[position:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(data)
+        start = line_end + 2
+        data += body[start:start + size]
+        position = start + size + 2
+
+
+async def read_body(request: Request) -> bytes:
+    body = await request.body()
+    content_sha = request.headers.get("x-amz-content-sha256", "")
+    if "aws-chunked" in request.headers.get("content-encoding", "") or content_sha.startswith("STREAMING-"):
+        return decode_aws_chunked(body)
+    return body
+
+
+def etag(data: bytes) -> str:
+    return f'"{hashlib.md5(data).hexdigest()}"'
+
+
+def xml_response(body: str, status_code: int = 200) -> Response:
+    return Response(
+        content=f'<?xml version="1.0" encoding="UTF-8"?>\n{body}',
+        status_code=status_code,
+        media_type="application/xml"
+    )
+
+
+def not_found(key: str) -> Response:
+    return xml_response(f"<Error><Code>NoSuchKey</Code><Key>{key}</Key></Error>", status_code=404)
+
+
+@app.middleware("http")
+async def simulate_latency(request: Request, call_next):
+    if FAKE_S3_LATENCY:
+        await asyncio.sleep(FAKE_S3_LATENCY)
+    return await call_next(request)
+
+
+@app.get("/_stats")
+async def stats():
+    return traffic
+
+
+@app.put("/{bucket}")
+async def create_bucket(bucket: str):
+    buckets[bucket]
+    return Response(status_code=200, headers={"Location": f"/{bucket}"})
+
+
+@app.post("/{bucket}")
+async def post_object(bucket: str, request: Request):
+    form = await request.form()
+    upload = form["file"]
+    data = await upload.read()
+    key = form["key"].replace("${filename}", upload.filename or "")
+    traffic["bytes_in"] += len(data)
+    traffic["puts"] += 1
+    buckets[bucket][key] = (data, form.get("Content-Type") or upload.content_type or "application/octet-stream")
+    return Response(status_code=204, headers={"ETag": etag(data), "Location": f"/{bucket}/{key}"})
+
+
+@app.put("/{bucket}/{key:path}")
+async def put_object(bucket: str, key: str, request: Request):
+    data = await read_body(request)
+    traffic["bytes_in"] += len(data)
+    upload_id = request.query_params.get("uploadId")
+    if upload_id:
+        if upload_id not in multipart_uploads:
+            return xml_response("<Error><Code>NoSuchUpload</Code></Error>", status_code=404)
+        multipart_uploads[upload_id]["parts"][int(request.query_params["partNumber"])] = data
+    else:
+        buckets[bucket][key] = (data, request.headers.get("content-type", "application/octet-stream"))
+        traffic["puts"] += 1
+    return Response(status_code=200, headers={"ETag": etag(data)})
+
+
+@app.post("/{bucket}/{key:path}")
+async def multipart(bucket: str, key: str, request: Request):
+    if "uploads" in request.query_params:
+        upload_id = uuid4().hex
+        multipart_uploads[upload_id] = {
+            "bucket": bucket,
+            "key": key,
+            "content_type": request.headers.get("content-type", "application/octet-stream"),
+            "parts": {}
+        }
+        return xml_response(
+            "<InitiateMultipartUploadResult>"
+            f"<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>"
+            "</InitiateMultipartUploadResult>"
+        )
+
+    upload = multipart_uploads.pop(request.query_params.get("uploadId"), None)
+    if upload is None:
+        return xml_response("<Error><Code>NoSuchUpload</Code></Error>", status_code=404)
+    data = b"".join(upload["parts"][number] for number in sorted(upload["parts"]))
+    buckets[bucket][key] = (data, upload["content_type"])
+    traffic["puts"] += 1
+    return xml_response(
+        "<CompleteMultipartUploadResult>"
+        f"<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>{etag(data)}</ETag>"
+        "</CompleteMultipartUploadResult>"
+    )
+
+
+@app.get("/{bucket}/{key:path}")
+async def get_object(bucket: str, key: str):
+    if key not in buckets[bucket]:
+        return not_found(key)
+    data, content_type = buckets[bucket][key]
+    traffic["bytes_out"] += len(data)
+    traffic["gets"] += 1
+    return Response(content=data, media_type=content_type, headers={"ETag": etag(data)})
+
+
+@app.head("/{bucket}/{key:path}")
+async def head_object(bucket: str, key: str):
+    if key not in buckets[bucket]:
+        return Response(status_code=404)
+    data, content_type = buckets[bucket][key]
+    return Response(headers={"Content-Length": str(len(data)), "Content-Type": content_type, "ETag": etag(data)})
+
+
+@app.delete("/{bucket}/{key:path}")
+async def delete_object(bucket: str, key: str, request: Request):
+    upload_id = request.query_params.get("uploadId")
+    if upload_id:
+        multipart_uploads.pop(upload_id, None)
+    else:
+        buckets[bucket].pop(key, None)
+    return Response(status_code=204)
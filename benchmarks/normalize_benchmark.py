@@ -0,0 +1,99 @@
+"""
+Before/after benchmark for reference image normalization.
+
+Runs benchmarks.run_benchmark twice with the same load, uploading
+camera-like JPEGs as reference images: once with
+REFERENCE_NORMALIZE_ENABLED=false and once with it on. It then compares
+the bytes written to S3, the bytes fake RunPod workers downloaded, the
+request latency and the time until each job completes:
+
+    python -m benchmarks.normalize_benchmark --photo-mp 24 --runpod-download-mbps 200
+
+Options not listed here are passed through to run_benchmark (for example
+--concurrency, --requests or --app-env REFERENCE_MAX_EDGE=1536).
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from typing import Optional
+from benchmarks.run_benchmark import REPO_ROOT, parse_args, run
+
+
+def megabytes(value: Optional[float]) -> str:
+    return f"{value / 1e6:.1f} MB" if value is not None else "-"
+
+
+def milliseconds(value: Optional[float]) -> str:
+    return f"{value:.0f} ms" if value is not None else "-"
+
+
+def change(before: Optional[float], after: Optional[float]) -> str:
+    if not before or after is None:
+        return ""
+    return f"{(after - before) / before:+.1%}"
+
+
+def print_comparison(before: dict, after: dict, scenario: str):
+    rows = [
+        ("S3 bytes written", before["traffic"]["s3_bytes_in"], after["traffic"]["s3_bytes_in"], megabytes),
+        ("RunPod input download", before["traffic"]["runpod_input_bytes"], after["traffic"]["runpod_input_bytes"], megabytes),
+    ]
+    for label, section, metric in [
+        ("request p50", "latency", "p50_ms"),
+        ("request p95", "latency", "p95_ms"),
+        ("job done p50", "completion", "p50_ms"),
+        ("job done p95", "completion", "p95_ms"),
+    ]:
+        rows.append((
+            label,
+            before["scenarios"][scenario].get(section, {}).get(metric),
+            after["scenarios"][scenario].get(section, {}).get(metric),
+            milliseconds
+        ))
+    seconds_before = before["traffic"]["runpod_input_seconds_per_job"]
+    seconds_after = after["traffic"]["runpod_input_seconds_per_job"]
+    rows.append((
+        "worker download per job",
+        seconds_before * 1000 if seconds_before is not None else None,
+        seconds_after * 1000 if seconds_after is not None else None,
+        milliseconds
+    ))
+
+    print(f"\n{'':<24} {'original':>12} {'normalized':>12} {'change':>9}")
+    for label, before_value, after_value, formatter in rows:
+        print(f"{label:<24} {formatter(before_value):>12} {formatter(after_value):>12} {change(before_value, after_value):>9}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare job cost with and without reference image normalization")
+    parser.add_argument("--photo-mp", type=float, default=24, help="megapixels of the uploaded reference photos")
+    parser.add_argument("--scenario", default="generate", choices=["generate", "change"])
+    parser.add_argument("--save", help="write both runs to this JSON file")
+    args, passthrough = parser.parse_known_args(argv)
+
+    if os.path.exists(os.path.join(REPO_ROOT, ".env")):
+        print("Warning: .env in the repository root overrides the benchmark's app settings")
+
+    runs = {}
+    for label, enabled in [("original", "false"), ("normalized", "true")]:
+        print(f"\n== Reference images {label} ==", flush=True)
+        run_args = parse_args(passthrough + [
+            "--scenarios", args.scenario,
+            "--photo-mp", str(args.photo_mp),
+            "--app-env", f"REFERENCE_NORMALIZE_ENABLED={enabled}"
+        ])
+        runs[label] = asyncio.run(run(run_args))
+
+    print_comparison(runs["original"], runs["normalized"], args.scenario)
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(runs, results_file, indent=2)
+        print(f"\nSaved results to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,541 @@
+"""
+Load benchmark for the API, run against local RunPod and S3 stand-ins so
+no GPU time or AWS traffic is spent.
+
+It starts benchmarks.fake_runpod, benchmarks.fake_s3 and app.main:app as
+uvicorn subprocesses on a fresh SQLite database, registers one account per
+concurrent client, then drives each scenario in turn:
+
+    login     POST /api/auth/login
+    generate  POST /api/generate/ and wait for the job to finish
+    change    POST /api/generate/change/{id} and wait for the job to finish
+    list      GET  /api/generate/list
+
+Per scenario it reports p50/p95/p99 latency and throughput, plus the
+time until the generation job completes for generate and change. It also
+reports the API's peak RSS and the bytes moved through the fake S3 and
+downloaded by fake RunPod workers. Reference images are random bytes
+(--image-kb) or camera-like JPEGs (--photo-mp). Results can be saved as a JSON baseline and
+later runs compared against it:
+
+    python -m benchmarks.run_benchmark --concurrency 20 --requests 200 --save benchmarks/baseline.json
+    python -m benchmarks.run_benchmark --concurrency 20 --requests 200 --compare benchmarks/baseline.json
+
+App settings can be overridden with --app-env KEY=VALUE. Note that a .env
+file in the repository root is loaded with override=True by app.main and
+takes precedence over them.
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ["login", "generate", "change", "list"]
+TERMINAL_STATUSES = ["completed", "failed"]
+PASSWORD = "bench-password"
+
+
+def percentile(samples: List[float], fraction: float) -> Optional[float]:
+    """
+    Linear-interpolated percentile of the samples, fraction in [0, 1].
+    """
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * fraction
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(samples: List[float]) -> dict:
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 2) if samples else None,
+        "p95_ms": round(percentile(samples, 0.95) * 1000, 2) if samples else None,
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 2) if samples else None,
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 2) if samples else None,
+        "max_ms": round(max(samples) * 1000, 2) if samples else None
+    }
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """
+    High-water resident set size of a process from /proc (Linux only).
+    """
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+    return None
+
+
+def child_pids(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # Field 4 is the parent pid; the command name may contain spaces
+                if int(stat.read().rsplit(")", 1)[1].split()[1]) == pid:
+                    children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+class Services:
+    """
+    The fake RunPod, the fake S3 and the API, each a uvicorn subprocess.
+    """
+    def __init__(self, args):
+        self.args = args
+        self.workdir = tempfile.mkdtemp(prefix="image-gen-bench-")
+        self.processes: Dict[str, subprocess.Popen] = {}
+        self.runpod_url = f"http://127.0.0.1:{args.port + 1}"
+        self.s3_url = f"http://127.0.0.1:{args.port + 2}"
+        self.api_url = f"http://127.0.0.1:{args.port}"
+
+    def _start(self, name: str, target: str, port: int, env: dict):
+        log = open(os.path.join(self.workdir, f"{name}.log"), "w")
+        self.processes[name] = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+            cwd=REPO_ROOT,
+            env={**os.environ, **env},
+            stdout=log,
+            stderr=subprocess.STDOUT
+        )
+
+    def app_env(self) -> dict:
+        env = {
+            "DATABASE_URL": f"sqlite:///{os.path.join(self.workdir, 'bench.db')}",
+            "RUNPOD_BASE_URL": f"{self.runpod_url}/v2",
+            "RUNPOD_ENDPOINT": "bench",
+            "S3_ENDPOINT_URL": self.s3_url,
+            "BUCKET_NAME": "bench",
+            "API_KEY": "bench",
+            "API_SECRET": "bench",
+            "AWS_REGION": "us-east-1",
+            # Every client is its own user; keep the per-user rate limit out of the way
+            "GENERATION_RATE": "1000",
+            "GENERATION_BURST": "1000"
+        }
+        for setting in self.args.app_env:
+            key, _, value = setting.partition("=")
+            env[key] = value
+        return env
+
+    async def start(self):
+        args = self.args
+        self._start("fake_runpod", "benchmarks.fake_runpod:app", args.port + 1, {
+            "FAKE_RUNPOD_LATENCY": str(args.runpod_latency),
+            "FAKE_RUNPOD_LATENCY_DIST": args.runpod_latency_dist,
+            "FAKE_RUNPOD_LATENCY_SPREAD": str(args.runpod_latency_spread),
+            "FAKE_RUNPOD_WORKERS": str(args.runpod_workers),
+            "FAKE_RUNPOD_FAILURE_RATE": str(args.runpod_failure_rate),
+            "FAKE_RUNPOD_SUBMIT_ERROR_RATE": str(args.runpod_submit_error_rate),
+            # Real outputs, so the thumbnail pipeline does its usual work
+            "FAKE_RUNPOD_OUTPUT_URL": f"{self.s3_url}/bench",
+            "FAKE_RUNPOD_FETCH_INPUTS": "true",
+            "FAKE_RUNPOD_DOWNLOAD_MBPS": str(args.runpod_download_mbps)
+        })
+        self._start("fake_s3", "benchmarks.fake_s3:app", args.port + 2, {
+            "FAKE_S3_LATENCY": str(args.s3_latency)
+        })
+        self._start("api", "app.main:app", args.port, self.app_env())
+
+        async with httpx.AsyncClient() as client:
+            for name, url in [("fake_runpod", self.runpod_url + "/docs"), ("fake_s3", self.s3_url + "/docs"), ("api", self.api_url + "/")]:
+                await self._wait_ready(client, name, url)
+            await client.put(f"{self.s3_url}/bench")
+
+    async def _wait_ready(self, client: httpx.AsyncClient, name: str, url: str, timeout: float = 30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.processes[name].poll() is not None:
+                break
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"{name} did not start, see {os.path.join(self.workdir, name + '.log')}")
+
+    def memory(self) -> dict:
+        api = self.processes["api"]
+        children = [peak_rss_mb(pid) for pid in child_pids(api.pid)]
+        return {
+            "api_peak_rss_mb": peak_rss_mb(api.pid),
+            "api_children_peak_rss_mb": round(sum(rss for rss in children if rss), 1) if children else None
+        }
+
+    async def traffic(self) -> dict:
+        async with httpx.AsyncClient() as client:
+            s3 = (await client.get(f"{self.s3_url}/_stats")).json()
+            runpod = (await client.get(f"{self.runpod_url}/_stats")).json()
+        return {
+            "s3_bytes_in": s3["bytes_in"],
+            "s3_bytes_out": s3["bytes_out"],
+            "runpod_input_bytes": runpod["bytes"],
+            "runpod_input_seconds_per_job": round(runpod["seconds"] / runpod["jobs"], 3) if runpod["jobs"] else None
+        }
+
+    def stop(self):
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+_photos: Dict[float, bytes] = {}
+
+
+def photo_jpeg(megapixels: float) -> bytes:
+    """
+    A phone-photo-like JPEG: 4:3, noisy enough to compress like a real
+    photo and tagged with EXIF orientation 6 (rotated 90 degrees), as
+    portrait shots usually are. Rendered once per size.
+    """
+    if megapixels not in _photos:
+        from PIL import Image
+
+        width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+        height = int(width * 3 / 4)
+        gradient = Image.linear_gradient("L").resize((width, height))
+        noise = Image.effect_noise((width, height), 48)
+        image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=95, exif=exif)
+        _photos[megapixels] = output.getvalue()
+    return _photos[megapixels]
+
+
+def unique_jpeg(data: bytes) -> bytes:
+    """
+    The same JPEG with a random comment segment after the SOI marker, so
+    each upload has a new content hash but decodes identically.
+    """
+    comment = uuid4().hex.encode("ascii")
+    return data[:2] + b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + data[2:]
+
+
+class BenchmarkClient:
+    """
+    One simulated user: its own account, token and generation sessions.
+    """
+    def __init__(self, http: httpx.AsyncClient, index: int, args):
+        self.http = http
+        self.args = args
+        self.email = f"bench-{index}-{uuid4().hex[:8]}@example.com"
+        self.headers = {}
+        self.sessions: List[int] = []
+
+    async def register(self):
+        response = await self.http.post("/api/auth/register", json={
+            "firstname": "Bench", "lastname": "User", "email": self.email, "password": PASSWORD
+        })
+        response.raise_for_status()
+        await self.login()
+
+    async def login(self, extra: dict = None) -> int:
+        response = await self.http.post("/api/auth/login", json={"email": self.email, "password": PASSWORD})
+        if response.status_code == 200:
+            self.headers = {"Authorization": f"Bearer {response.json()['data']['access_token']}"}
+        return response.status_code
+
+    async def _reference_image(self, file_field: str, key_field: str) -> Tuple[dict, Optional[dict]]:
+        """
+        Form fields and files carrying a reference image, uploaded through
+        the API or, with --direct-upload, straight to S3 via a presigned PUT.
+        """
+        if self.args.photo_mp:
+            image, content_type, extension = unique_jpeg(photo_jpeg(self.args.photo_mp)), "image/jpeg", "jpg"
+        elif self.args.image_kb:
+            # Random bytes so uploads are not deduplicated by content hash
+            image, content_type, extension = os.urandom(self.args.image_kb * 1024), "image/png", "png"
+        else:
+            return {}, None
+        if not self.args.direct_upload:
+            return {}, {file_field: (f"{uuid4().hex}.{extension}", image, content_type)}
+
+        response = await self.http.post(
+            "/api/generate/uploads", json={"content_type": content_type, "size": len(image)}, headers=self.headers
+        )
+        response.raise_for_status()
+        upload = response.json()["data"]
+        (await self.http.put(upload["put"]["url"], content=image, headers=upload["put"]["headers"])).raise_for_status()
+        return {key_field: upload["s3_key"]}, None
+
+    async def wait_for_job(self, session_id: int) -> Optional[float]:
+        started_at = time.perf_counter()
+        while time.perf_counter() - started_at < self.args.job_timeout:
+            response = await self.http.get(f"/api/generate/status/{session_id}", headers=self.headers)
+            if response.status_code == 200 and response.json()["data"]["status"] in TERMINAL_STATUSES:
+                return time.perf_counter() - started_at
+            await asyncio.sleep(self.args.poll_interval)
+        return None
+
+    async def generate(self, extra: dict) -> int:
+        started_at = time.perf_counter()
+        fields, files = await self._reference_image("reference_image", "reference_image_key")
+        response = await self.http.post(
+            "/api/generate/",
+            data={"input_prompt": f"benchmark product shot {uuid4().hex}", **fields},
+            files=files,
+            headers=self.headers
+        )
+        extra["request"] = time.perf_counter() - started_at
+        if response.status_code in [200, 202]:
+            session_id = response.json()["data"]["session_id"]
+            self.sessions.append(session_id)
+            if response.status_code == 202 and self.args.wait:
+                waited = await self.wait_for_job(session_id)
+                if waited is not None:
+                    extra["complete"] = time.perf_counter() - started_at
+        return response.status_code
+
+    async def change(self, extra: dict) -> int:
+        if not self.sessions:
+            await self.generate({})
+            if not self.sessions:
+                return 0
+        session_id = self.sessions[-1]
+        started_at = time.perf_counter()
+        fields, files = await self._reference_image("new_image", "new_image_key")
+        response = await self.http.post(
+            f"/api/generate/change/{session_id}",
+            data={"new_prompt": f"benchmark edit {uuid4().hex}", "use_previous_image": "false", **fields},
+            files=files,
+            headers=self.headers
+        )
+        extra["request"] = time.perf_counter() - started_at
+        # The next change on this session needs this one to have finished
+        if response.status_code == 202:
+            waited = await self.wait_for_job(session_id)
+            if waited is not None:
+                extra["complete"] = time.perf_counter() - started_at
+        return response.status_code
+
+    async def list(self, extra: dict) -> int:
+        response = await self.http.get("/api/generate/list", params={"limit": 50}, headers=self.headers)
+        return response.status_code
+
+
+async def run_scenario(name: str, clients: List[BenchmarkClient], requests: int) -> dict:
+    """
+    Each client issues requests back to back until the scenario's total is reached.
+    """
+    latencies: List[float] = []
+    completions: List[float] = []
+    statuses: Counter = Counter()
+    counter = itertools.count()
+
+    async def run_client(client: BenchmarkClient):
+        operation: Callable = getattr(client, name)
+        while next(counter) < requests:
+            extra = {}
+            started_at = time.perf_counter()
+            try:
+                status = await operation(extra)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(extra.get("request", time.perf_counter() - started_at))
+            if "complete" in extra:
+                completions.append(extra["complete"])
+            statuses[str(status)] += 1
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(run_client(client) for client in clients))
+    elapsed = time.perf_counter() - started_at
+
+    ok = sum(count for status, count in statuses.items() if status in ["200", "201", "202"])
+    result = {
+        "requests": len(latencies),
+        "ok": ok,
+        "errors": len(latencies) - ok,
+        "statuses": dict(statuses),
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency": summarize(latencies)
+    }
+    if completions:
+        result["completion"] = summarize(completions)
+    return result
+
+
+def print_report(results: dict):
+    print(f"{'scenario':<10} {'reqs':>6} {'errors':>6} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'done p95 ms':>12}")
+    for name, result in results["scenarios"].items():
+        latency = result["latency"]
+        completion = result.get("completion", {})
+        print(
+            f"{name:<10} {result['requests']:>6} {result['errors']:>6} {result['throughput_rps'] or 0:>8.1f} "
+            f"{latency['p50_ms'] or 0:>9.1f} {latency['p95_ms'] or 0:>9.1f} {latency['p99_ms'] or 0:>9.1f} "
+            f"{completion.get('p95_ms') or 0:>12.1f}"
+        )
+    memory = results["memory"]
+    print(f"API peak RSS: {memory['api_peak_rss_mb']} MB (worker processes: {memory['api_children_peak_rss_mb']} MB)")
+    traffic = results.get("traffic")
+    if traffic:
+        print(
+            f"S3 bytes in/out: {traffic['s3_bytes_in'] / 1e6:.1f} / {traffic['s3_bytes_out'] / 1e6:.1f} MB, "
+            f"RunPod input download: {traffic['runpod_input_bytes'] / 1e6:.1f} MB "
+            f"({traffic['runpod_input_seconds_per_job'] or 0:.3f} s per job)"
+        )
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    Regressions beyond tolerance (a fraction) against a saved baseline.
+    """
+    regressions = []
+    print(f"\nCompared with baseline from {baseline['meta']['timestamp']} ({baseline['meta'].get('git_commit')}):")
+    for name, result in results["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if not previous:
+            continue
+        checks = [("throughput_rps", result["throughput_rps"], previous["throughput_rps"], False)]
+        for section in ["latency", "completion"]:
+            for metric in ["p50_ms", "p95_ms", "p99_ms"]:
+                current_value = result.get(section, {}).get(metric)
+                previous_value = previous.get(section, {}).get(metric)
+                checks.append((f"{section}.{metric}", current_value, previous_value, True))
+
+        for metric, current_value, previous_value, lower_is_better in checks:
+            if not current_value or not previous_value:
+                continue
+            change = (current_value - previous_value) / previous_value
+            worse = change > tolerance if lower_is_better else change < -tolerance
+            marker = "  REGRESSION" if worse else ""
+            print(f"  {name:<10} {metric:<20} {previous_value:>10} -> {current_value:>10} ({change:+.1%}){marker}")
+            if worse:
+                regressions.append(f"{name} {metric} {change:+.1%}")
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    services = Services(args)
+    try:
+        await services.start()
+        limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=services.api_url, timeout=args.request_timeout, limits=limits) as http:
+            clients = [BenchmarkClient(http, index, args) for index in range(args.concurrency)]
+            await asyncio.gather(*(client.register() for client in clients))
+
+            scenarios = {}
+            for name in args.scenarios:
+                print(f"Running {name} ({args.requests} requests, concurrency {args.concurrency})...", flush=True)
+                scenarios[name] = await run_scenario(name, clients, args.requests)
+
+        return {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "git_commit": git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "config": {
+                    key: value for key, value in vars(args).items() if key not in ["save", "compare"]
+                }
+            },
+            "scenarios": scenarios,
+            "memory": services.memory(),
+            "traffic": await services.traffic()
+        }
+    finally:
+        services.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the image generation API against local fakes")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=SCENARIOS,
+                        help=f"comma-separated subset of {','.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", type=int, default=10, help="concurrent clients, each its own user")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--image-kb", type=int, default=0, help="size of a random reference image to upload; 0 for none")
+    parser.add_argument("--photo-mp", type=float, default=0,
+                        help="upload a camera-like JPEG of this many megapixels as reference image; overrides --image-kb")
+    parser.add_argument("--direct-upload", action="store_true",
+                        help="upload reference images through presigned S3 URLs instead of through the API")
+    parser.add_argument("--no-wait", dest="wait", action="store_false", help="do not wait for generate jobs to finish")
+    parser.add_argument("--poll-interval", type=float, default=0.25, help="status polling interval while waiting for jobs")
+    parser.add_argument("--job-timeout", type=float, default=300)
+    parser.add_argument("--request-timeout", type=float, default=60)
+    parser.add_argument("--runpod-latency", type=float, default=2.0, help="mean fake RunPod job runtime in seconds")
+    parser.add_argument("--runpod-latency-dist", default="fixed", choices=["fixed", "uniform", "normal", "lognormal", "exponential"])
+    parser.add_argument("--runpod-latency-spread", type=float, default=0.0)
+    parser.add_argument("--runpod-workers", type=int, default=0, help="fake RunPod GPU workers; 0 for unlimited")
+    parser.add_argument("--runpod-failure-rate", type=float, default=0.0)
+    parser.add_argument("--runpod-submit-error-rate", type=float, default=0.0)
+    parser.add_argument("--runpod-download-mbps", type=float, default=0,
+                        help="fake RunPod workers' download speed for reference images; 0 for unthrottled")
+    parser.add_argument("--s3-latency", type=float, default=0.0, help="added latency per fake S3 request in seconds")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="extra API setting")
+    parser.add_argument("--port", type=int, default=18000, help="API port; the fakes use the next two")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed regression as a fraction")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if os.path.exists(os.path.join(REPO_ROOT, ".env")):
+        print("Warning: .env in the repository root overrides the benchmark's app settings")
+
+    results = asyncio.run(run(args))
+    print()
+    print_report(results)
+
+    if args.save:
+        with open(args.save, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())